@@ -1,58 +1,150 @@
+import functools
 import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
 from __tasklib__ import TaskBuilder, TaskContext
-
-
-def _get_pytest_cmd():
-    files = " ".join(glob("./tests/test_*.py"))
-    return f"pytest --lf -v --capture=tee-sys {files}"
+from version import VersionBuilder, VersionViewBuilder
+
+TEST_FILES_PATTERN = "./tests/test_*.py"
+TEST_ARGV = ["./task", "test"]
+VERSION_ARGV = ["python", "version.py", "minor", "--show", "all", "--format", "env"]
+WATCHEXEC_ARGV = ["watchexec", "-r", "--project-origin", ".", "-w", ".", "-e", "py"]
+BUILD_ENV_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".local", "build-env"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _find_test_files(pattern):
+    return tuple(glob(pattern))
+
+
+def _get_pytest_argv(nodeids=None):
+    targets = nodeids if nodeids else _find_test_files(TEST_FILES_PATTERN)
+    # the shards are already run in parallel, dont let each one start xdist workers as well
+    return ["pytest", "-n", "0", "-v", "--capture=tee-sys", *targets]
+
+
+def _shard_nodeids(ctx: TaskContext, n, files=None):
+    """
+    Collects the test node ids once and splits them into n evenly sized shards
+    """
+    files = files if files else _find_test_files(TEST_FILES_PATTERN)
+    ret = ctx.exec(["pytest", "--collect-only", "-q", *files], capture=True)
+    nodeids = [line.strip() for line in ret.stdout.splitlines() if "::" in line]
+    n = max(1, min(n, len(nodeids)))
+    return [nodeids[i::n] for i in range(n)]
+
+
+def _changed_test_files(changes):
+    """
+    Returns the changed test files if only tests changed, otherwise None so the
+    whole suite runs (a change to any other module may affect every test)
+    """
+    if not changes:
+        return None
+    test_files = {os.path.abspath(f) for f in _find_test_files(TEST_FILES_PATTERN)}
+    if not all(path in test_files for path in changes):
+        return None
+    return sorted(os.path.relpath(path) for path in changes)
+
+
+def _watch(ctx: TaskContext, argv, on_change):
+    """
+    Calls on_change(changes) in this process whenever a python file changes. Uses
+    watchexec to rerun argv instead when WATCH_BACKEND=external or watchfiles is
+    not installed.
+    """
+    try:
+        from watchfiles import Change, PythonFilter, watch
+    except ImportError:
+        watch = None
+
+    if watch is None or os.environ.get("WATCH_BACKEND") == "external":
+        ctx.exec([*WATCHEXEC_ARGV, *argv])
+        return
+
+    on_change(None)
+    for changes in watch(ctx.project_dir, watch_filter=PythonFilter()):
+        if any(change != Change.modified for change, _ in changes):
+            # files were added or deleted, glob for the test files again
+            _find_test_files.cache_clear()
+        on_change({path for _, path in changes})
 
 
 def _hello(ctx: TaskContext):
     ctx.log.info("Hello")
 
 
+def _run_shard(argv, prefix, lock):
+    """
+    Runs a shard, writing its output line by line as it comes in. Returns the exit code
+    """
+    try:
+        proc = subprocess.Popen(
+            argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
+        )
+    except OSError as ex:
+        with lock:
+            sys.stdout.write(f"{prefix}{ex}\n")
+        return 1
+
+    with proc:
+        for line in proc.stdout:
+            with lock:
+                sys.stdout.write(f"{prefix}{line}")
+                sys.stdout.flush()
+        return proc.wait()
+
+
+def _run_tests(ctx: TaskContext, files=None):
+    """
+    Runs the tests in parallel shards, returns the indexes of the shards that failed
+    """
+    shards = _shard_nodeids(ctx, max(1, (os.cpu_count() or 1) - 2), files)
+    lock = threading.Lock()
+
+    def run_shard(i):
+        # shard output is interleaved, the prefix tells the lines apart
+        prefix = f"[{i}] " if len(shards) > 1 else ""
+        return _run_shard(_get_pytest_argv(shards[i]), prefix, lock)
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        returncodes = list(executor.map(run_shard, range(len(shards))))
+
+    failed = [i for i, returncode in enumerate(returncodes) if returncode != 0]
+    if failed:
+        ctx.log.error(f"Test shard(s) failed: {failed}")
+    return failed
+
+
 def _test(ctx: TaskContext):
-    ctx.exec(_get_pytest_cmd())
+    if _run_tests(ctx):
+        sys.exit(1)
 
 
 def _test_watch(ctx: TaskContext):
-    ctx.exec(
-        f"""
-        watchexec
-            -r --project-origin .
-            -w .
-            -e py
-             {_get_pytest_cmd()}
-        """
+    _watch(
+        ctx, TEST_ARGV, lambda changes: _run_tests(ctx, _changed_test_files(changes))
     )
 
 
 def _version_watch(ctx: TaskContext):
-    ctx.exec(
-        f"""
-        watchexec
-            -r --project-origin .
-            -w .
-            -e py
-            python version.py minor --show all --format env
-        """
-    )
+    _watch(ctx, VERSION_ARGV, lambda changes: ctx.exec(VERSION_ARGV))
 
 
 def _ci_version(ctx: TaskContext, increment):
-    if not os.path.exists(".local"):
-        os.makedirs(".local")
+    os.makedirs(os.path.dirname(BUILD_ENV_FILE), exist_ok=True)
 
-    ret = ctx.exec(f"python version.py {increment} --format env", capture=True)
-    out = ret.stdout.strip()
+    ver = VersionBuilder().withIncrement(increment.upper()).build()
+    out = VersionViewBuilder(ver).withFormat("env").build()
     ctx.log.info(out)
 
-    build_env = os.path.abspath(
-        os.path.join(os.path.dirname(__file__), ".local", "build-env")
-    )
-    with open(build_env, "w") as f:
+    with open(BUILD_ENV_FILE, "w") as f:
         f.write(out)
 
 
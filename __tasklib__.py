@@ -2,6 +2,20 @@
 # https://github.com/chris-garrett/python-task #
 ################################################
 #
+# Oct 15 2026
+# * fix: load_dotenv expanded every $-prefixed var in os.environ, not just the ones it loaded. only the values
+#        loaded from the file are expanded now, wherever the $ is in the value.
+# * fix: load_dotenv skips lines with an empty key. values are collected in one pass and written to os.environ
+#        with a single update().
+# * chore: load_dotenv matches lines with a precompiled regex
+# * feat: add tail_lines to exec(). when capturing, output is streamed and only the last N lines of stdout and
+#         stderr are kept in memory. example:
+#    (args=['git', 'log'], returncode=0, stdout='<last line>\n', stderr='') = ctx.exec("git log", capture=True, tail_lines=1)
+# * feat: exec() accepts a list (or any other sequence) of args which is passed through as is instead of being
+#         parsed with shlex.
+# * feat: independent tasks run at the same time on up to cpu_count - 2 threads. they are started in the order
+#         given on the command line but can finish in any order. ctrl-c exits without waiting on running tasks.
+#
 # Apr 20 2024
 # * chore: support single file task projects
 #   * moved __task__.py to __tasklib__.py
@@ -37,20 +51,26 @@
 # * add support for file depenencies. see go-task for inspiration: https://taskfile.dev/usage/#prevent-unnecessary-work
 
 import os
+import re
 import sys
-import glob
 import shlex
+import functools
 import typing
 import logging
-import platform
 from logging import Logger
-import argparse
+from string import Template
+import queue
+import threading
 import subprocess
+from collections import deque
 from subprocess import CompletedProcess
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import NamedTuple, Callable, List, Protocol, runtime_checkable
-import importlib.machinery
-import inspect
+
+
+# KEY=value, the key is everything before the first = (dots etc. included) less surrounding whitespace
+_DOTENV_RE = re.compile(rb"^\s*([^#=\s][^=]*?)\s*=(.*)$")
 
 
 def load_dotenv(filename=".env", override=False, expand_vars=True):
@@ -61,36 +81,40 @@ def load_dotenv(filename=".env", override=False, expand_vars=True):
     - filename (str, optional): The name of the .env file to load. Defaults to ".env".
     - override (bool, optional): If True, existing environment variables will be overwritten
       by those in the .env file. Defaults to False.
+    - expand_vars (bool, optional): If True, $VAR and ${VAR} references in the values loaded
+      from the file are expanded once the whole file has been read. Defaults to True.
 
     Returns:
     None
     """
     if not os.path.exists(filename):
         return
-    with open(filename) as f:
-        for line in f:
-            line = line.strip()
 
-            # skip comments and empty lines
-            if line.startswith("#") or "=" not in line:
+    pending: typing.Dict[str, str] = {}
+    with open(filename, "rb") as f:
+        for line in f:
+            # comments, empty lines and lines without a KEY= dont match
+            m = _DOTENV_RE.match(line)
+            if not m:
                 continue
 
-            k, v = line.split("=", 1)
-            k = k.strip()
+            k = m.group(1).decode()
 
-            # dont override existing env vars unless explicitly told to
-            if k in os.environ and not override:
+            # dont override existing env vars unless explicitly told to, the first value in the file wins
+            if not override and (k in os.environ or k in pending):
                 continue
 
-            # dont set null values
-            if v is not None:
-                os.environ[k] = v.strip()
+            pending[k] = m.group(2).decode().strip()
 
     if expand_vars:
-        # expand any env vars
-        for k, v in os.environ.items():
-            if v.startswith("$"):
-                os.environ[k] = os.path.expandvars(v)
+        # expanded once the whole file is read so values can refer to keys further down. only the values
+        # from this file are expanded, other env vars are left as they are
+        env = {**os.environ, **pending}
+        for k, v in pending.items():
+            if "$" in v:
+                pending[k] = env[k] = Template(v).safe_substitute(env)
+
+    os.environ.update(pending)
 
 
 def trace(self, message, *args, **kws):
@@ -102,10 +126,22 @@ TRACE_LEVEL = 5
 logging.addLevelName(TRACE_LEVEL, "TRACE")
 logging.Logger.trace = trace
 
-logging.basicConfig(
-    level=os.environ.get("LOG_LEVEL", "INFO"),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
+
+class LogFormatter(logging.Formatter):
+    """
+    Formats records as "asctime - name - levelname - message" with an f-string instead of %-style formatting.
+    """
+
+    def format(self, record):
+        line = f"{self.formatTime(record)} - {record.name} - {record.levelname} - {record.getMessage()}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(LogFormatter())
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), handlers=[log_handler])
 logger = logging.getLogger("task")
 
 
@@ -121,23 +157,78 @@ class SystemContext(NamedTuple):
     distro: str  # Debian, Arch, RHEL
 
 
+@functools.lru_cache(maxsize=256)
+def _split_cmd(cmd: str) -> typing.Tuple[str, ...]:
+    """
+    Splits a command line into args. Cached as watch/test loops run the same commands over and over.
+    """
+    return tuple(shlex.split(cmd))
+
+
+def _exec_tail(args, cwd, env, input, tail_lines) -> CompletedProcess[str]:
+    """
+    Runs args, streaming stdout and stderr and only keeping the last tail_lines of each in memory.
+    """
+    with subprocess.Popen(
+        args,
+        text=True,
+        bufsize=1,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as proc:
+        tails = (deque(maxlen=tail_lines), deque(maxlen=tail_lines))
+        drains = [
+            threading.Thread(target=tail.extend, args=(stream,), daemon=True)
+            for tail, stream in zip(tails, (proc.stdout, proc.stderr))
+        ]
+        for drain in drains:
+            drain.start()
+        if input is not None:
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass  # child exited without reading all of its input
+        for drain in drains:
+            drain.join()
+        returncode = proc.wait()
+
+    return CompletedProcess(args=args, returncode=returncode, stdout="".join(tails[0]), stderr="".join(tails[1]))
+
+
 def exec(
-    cmd: str, cwd: str = None, logger: Logger = None, venv_dir: str = None, capture: bool = False, input: str = None
+    cmd: typing.Union[str, typing.Sequence[str]],
+    cwd: str = None,
+    logger: Logger = None,
+    venv_dir: str = None,
+    capture: bool = False,
+    input: str = None,
+    tail_lines: int = None,
 ) -> CompletedProcess[str]:
-    args = [arg.strip() for arg in shlex.split(cmd.strip())]
+    args = list(_split_cmd(cmd)) if isinstance(cmd, str) else list(cmd)
     if isinstance(logger, Logger) and not capture:
         if cwd:
             logger.debug("Executing: [%s] Cwd: [%s]", " ".join(args), cwd)
         else:
             logger.debug("Executing: [%s]", " ".join(args))
 
+    # inherit the current env as is unless a different venv was requested
+    if not venv_dir or os.environ.get("VIRTUAL_ENV") == f"{venv_dir}/bin":
+        env = None
+    else:
+        env = _build_env(os.environ, venv_dir)
     try:
+        if capture and tail_lines is not None:
+            return _exec_tail(args, cwd, env, input, tail_lines)
         return subprocess.run(
             args,
             check=False,
             text=True,
             cwd=cwd,
-            env=_build_env(os.environ, venv_dir) if venv_dir else os.environ,
+            env=env,
             capture_output=capture,
             input=input,
         )
@@ -154,9 +245,15 @@ class TaskContext(ExecProtocol):
     system: SystemContext
 
     def exec(
-        self, cmd: str, cwd: str = None, venv_dir: str = None, capture: bool = False, input: str = None
+        self,
+        cmd: typing.Union[str, typing.Sequence[str]],
+        cwd: str = None,
+        venv_dir: str = None,
+        capture: bool = False,
+        input: str = None,
+        tail_lines: int = None,
     ) -> CompletedProcess[str]:
-        return exec(cmd, cwd, self.log, venv_dir, capture, input)
+        return exec(cmd, cwd, self.log, venv_dir, capture, input, tail_lines)
 
 
 class TaskFileDefinition(NamedTuple):
@@ -202,28 +299,25 @@ def _build_env(env, venv_dir):
     Replaces an old virtual env dir from path with a project
     level virtual env dir
     """
-    old_env = env.copy()
-
-    if "VIRTUAL_ENV" in old_env:
-        old_venv = f"{old_env['VIRTUAL_ENV']}/bin:"
+    if "VIRTUAL_ENV" in env:
+        old_venv = f"{env['VIRTUAL_ENV']}/bin:"
         # remove the old virtualenv path
-        old_path = old_env["PATH"][len(old_venv) :]  # noqa
+        old_path = env["PATH"][len(old_venv) :]  # noqa
     else:
-        old_path = old_env["PATH"]
-
-    # remove pythopath if it exists
-    if "PYTHONHOME" in old_env:
-        del old_env["PYTHONHOME"]
+        old_path = env["PATH"]
 
     new_venv = f"{venv_dir}/bin"
 
+    # copy the env in one pass, dropping pythonhome if it exists
+    new_env = {k: v for k, v in env.items() if k != "PYTHONHOME"}
+
     # replace it with project virt env dir
-    old_env["PATH"] = f"{new_venv}:{old_path}"
+    new_env["PATH"] = f"{new_venv}:{old_path}"
 
     # replace virt env
-    old_env["VIRTUAL_ENV"] = new_venv
+    new_env["VIRTUAL_ENV"] = new_venv
 
-    return old_env
+    return new_env
 
 
 def _ensure_venv(ctx: TaskContext):
@@ -246,42 +340,75 @@ def _load_tasks(task: TaskFileDefinition) -> typing.Dict[str, TaskDefinition]:
     return tasks
 
 
-def _load_task_definitions(task_files) -> List[TaskFileDefinition]:
+def _load_task_definition(idx: int, task_file: str) -> typing.Optional[TaskFileDefinition]:
     """
-    Loads tasks files if they match the required signature.
+    Loads a task file if it matches the required signature.
     """
-    tasks: List[TaskFileDefinition] = []
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(f"task{idx}", task_file)
+    module = importlib.util.module_from_spec(spec)
+    # registered before it runs, like an import. dataclasses and pickle look the module up by name
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    if not hasattr(module, "configure"):
+        logger.trace("load task definition: %s: no configure() found, skipping %s", task_file, task_file)
+        return None
+
+    func = getattr(module, "configure")
+    code = func.__code__
+    if "builder" not in code.co_varnames[: code.co_argcount + code.co_kwonlyargcount]:
+        logger.trace("load task definition: %s: no configure(builder) found, skipping %s", task_file, task_file)
+        return None
+
+    logger.trace("load task definition: %s: loaded successfully", task_file)
+    return TaskFileDefinition(
+        func=func,
+        filename=task_file,
+        dir=os.path.abspath(os.path.dirname(task_file)),
+    )
 
-    for idx, task_file in enumerate(task_files):
-        loader = importlib.machinery.SourceFileLoader(f"task{idx}", task_file)
-        module = loader.load_module()
-        if not hasattr(module, "configure"):
-            logger.trace(f"load task definition: {task_file}: no configure() found, skipping {task_file}")
-            continue
 
-        func = getattr(module, "configure")
-        parameters = inspect.signature(func).parameters
-        if "builder" not in parameters:
-            logger.trace(f"load task definition: {task_file}: no configure(builder) found, skipping {task_file}")
-            continue
+def _load_task_definitions(task_files) -> List[TaskFileDefinition]:
+    """
+    Loads tasks files if they match the required signature. Files are loaded in parallel, configure()
+    is called later on the main thread.
+    """
+    if not task_files:
+        return []
 
-        logger.trace(f"load task definition: {task_file}: loaded successfully")
-        tasks.append(
-            TaskFileDefinition(
-                func=func,
-                filename=task_file,
-                dir=os.path.abspath(os.path.dirname(task_file)),
-            )
-        )
+    with ThreadPoolExecutor(max_workers=min(8, len(task_files))) as executor:
+        tasks = executor.map(_load_task_definition, range(len(task_files)), task_files)
+        return [task for task in tasks if task is not None]
 
-    return tasks
+
+# directories that never contain task files. hidden directories (.git, .venv, .local) are always skipped
+TASK_IGNORE_DIRS = {"venv", "node_modules", "__pycache__", "dist", "build"}
 
 
 def _find_task_files() -> List[str]:
     """
-    Finds files that match naming convention
+    Finds files that match naming convention. Hidden directories and well known dependency/build
+    directories are not searched, extra directories can be skipped via TASK_IGNORE_DIRS (comma separated).
     """
-    return [f for f in glob.glob("**/__task__.py", recursive=True) if os.path.isfile(f)]
+    ignore_dirs = TASK_IGNORE_DIRS | {d.strip() for d in os.environ.get("TASK_IGNORE_DIRS", "").split(",") if d.strip()}
+
+    task_files = []
+    dirs = ["."]
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith(".") and entry.name not in ignore_dirs:
+                            dirs.append(entry.path)
+                    elif entry.name == "__task__.py" and entry.is_file():
+                        task_files.append(os.path.normpath(entry.path))
+        except OSError:
+            # unreadable directories (ie. root owned docker volumes) are skipped like glob did
+            continue
+
+    return sorted(task_files)
 
 
 def _build_system_distro(content: str) -> str:
@@ -299,10 +426,13 @@ def _build_system_distro(content: str) -> str:
     return id_like if id_like else id
 
 
+@functools.lru_cache(maxsize=1)
 def _build_system_context() -> SystemContext:
     """
-    Builds a context object for the system.
+    Builds a context object for the system. The result is cached as it can't change
+    while we are running.
     """
+    import platform
 
     distro = ""
     if platform.system() == "Linux" and os.path.exists("/etc/os-release"):
@@ -330,9 +460,7 @@ def _build_task_context(task: TaskDefinition) -> TaskContext:
 
 def _print_help(available_tasks: List[str]):
     # do a lazy sort to put tasks with no colons first
-    formatted_tasks = "".join(
-        [f"  {t}\n" for t in sorted(available_tasks, key=lambda x: (0 if x.count(":") == 0 else 1, x))]
-    )
+    formatted_tasks = "".join([f"  {t}\n" for t in sorted(available_tasks, key=lambda x: (":" in x, x))])
     print(
         f"""usage: task [-h] [task ...]
 
@@ -346,36 +474,119 @@ options:
     )
 
 
-def _resolve_deps(tasks_to_resolve, tasks):
-    # Convert list of tasks to a dictionary for easy access
-    task_dict = {list(task.keys())[0]: list(task.values())[0] for task in tasks}
-
+def _resolve_deps(tasks_to_resolve, tasks: typing.Dict[str, TaskDefinition]) -> List[str]:
+    """
+    Returns the tasks to run (dependencies first) using an iterative depth first search.
+    """
+    WHITE, GRAY, BLACK = 0, 1, 2  # unvisited, in progress, resolved
+    color: typing.Dict[str, int] = {}
     resolved = []  # List to store the resolved order of tasks
-    visited = set()  # Set to keep track of visited tasks to detect circular dependencies
-
-    def dfs(task):
-        if task in resolved:  # If already resolved, no need to proceed
-            return
-        if task in visited:  # Circular dependency detected
-            raise ValueError("Circular dependency detected")
-        visited.add(task)
 
-        # Resolve dependencies first
-        for dep in task_dict.get(task, {}).get("deps", []):
-            if dep not in resolved:
-                dfs(dep)
+    def deps_of(task):
+        return iter(tasks[task].deps if task in tasks else [])
 
-        visited.remove(task)  # Remove from visited as we are done with this task
-        resolved.append(task)  # Add to resolved list
+    for target in tasks_to_resolve:
+        if color.get(target, WHITE) != WHITE:
+            continue
 
-    for task in tasks_to_resolve:
-        if task not in resolved:
-            dfs(task)
+        color[target] = GRAY
+        stack = [(target, deps_of(target))]
+        while stack:
+            task, deps = stack[-1]
+            for dep in deps:
+                state = color.get(dep, WHITE)
+                if state == GRAY:
+                    raise ValueError("Circular dependency detected")
+                if state == WHITE:
+                    # resolve the dependency first, then come back to this task
+                    color[dep] = GRAY
+                    stack.append((dep, deps_of(dep)))
+                    break
+            else:
+                stack.pop()
+                color[task] = BLACK
+                resolved.append(task)
 
     return resolved
 
 
+def _run_task_thread(task: TaskDefinition, results: "queue.Queue"):
+    """
+    Runs a task on a worker thread and reports (task name, exception or None) to results.
+    """
+    try:
+        task.func(_build_task_context(task))
+    except BaseException as ex:
+        results.put((task.name, ex))
+    else:
+        results.put((task.name, None))
+
+
+def _run_tasks(resolved_tasks: List[str], tasks: typing.Dict[str, TaskDefinition]):
+    """
+    Runs the resolved tasks, starting each task as soon as its dependencies have finished so
+    independent tasks run at the same time. Ready tasks are started in the resolved order (the
+    order given on the command line), they can finish in any order. A lone ready task runs on
+    the main thread.
+    """
+    to_run = [task_name for task_name in resolved_tasks if task_name in tasks]
+    order = {task_name: i for i, task_name in enumerate(to_run)}
+    waiting_on = {task_name: {dep for dep in tasks[task_name].deps if dep in to_run} for task_name in to_run}
+    dependents: typing.Dict[str, List[str]] = {task_name: [] for task_name in to_run}
+    for task_name, deps in waiting_on.items():
+        for dep in deps:
+            dependents[dep].append(task_name)
+
+    def finished(task_name) -> List[str]:
+        # returns the dependents that are now ready to run
+        ready = []
+        for dependent in dependents[task_name]:
+            waiting_on[dependent].discard(task_name)
+            if not waiting_on[dependent]:
+                ready.append(dependent)
+        return ready
+
+    ready = [task_name for task_name in to_run if not waiting_on[task_name]]
+    max_workers = max(1, (os.cpu_count() or 1) - 2)
+    results = queue.Queue()
+    running = 0
+    error = None
+    try:
+        while ready or running:
+            if len(ready) == 1 and not running:
+                task = tasks[ready.pop()]
+                try:
+                    task.func(_build_task_context(task))
+                except KeyboardInterrupt:
+                    pass
+                ready.extend(finished(task.name))
+                continue
+
+            ready.sort(key=order.get)
+            while ready and running < max_workers:
+                task = tasks[ready.pop(0)]
+                # daemon threads so tasks that never return (ie. watch loops) don't keep ctrl-c from exiting
+                threading.Thread(target=_run_task_thread, args=(task, results), daemon=True).start()
+                running += 1
+
+            task_name, ex = results.get()
+            running -= 1
+            if ex is not None:
+                # let the running tasks finish but don't start anything else
+                error = error or ex
+                ready = []
+            elif error is None:
+                ready.extend(finished(task_name))
+    except KeyboardInterrupt:
+        pass
+
+    if error is not None:
+        raise error
+
+
 def _process_tasks():
+    import argparse
+
     logger.info("Processing tasks")
 
     # need to boostrap this arg so that we can enable debug logging at
@@ -410,26 +621,10 @@ def _process_tasks():
             _print_help(tasks.keys())
             return
 
-    # build a list of tasks and dependencies to pass to the resolver
-    # result should be:
-    # [
-    #   {
-    #       "task_name": {
-    #           "deps": ["dep1", "dep2"]
-    #       }
-    #   },
-    # ]
-    tasks_with_deps = [{k: {"deps": v.deps}} for k, v in tasks.items()]
-    resolved_tasks = _resolve_deps(args.tasks, tasks_with_deps)
+    resolved_tasks = _resolve_deps(args.tasks, tasks)
 
     # runtime
-    for task_name in resolved_tasks:
-        if task_name in tasks:
-            task = tasks[task_name]
-            try:
-                task.func(_build_task_context(task))
-            except KeyboardInterrupt:
-                pass
+    _run_tasks(resolved_tasks, tasks)
 
 
 if __name__ == "__main__":
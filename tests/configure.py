@@ -1,23 +1,48 @@
+import hashlib
+import inspect
+import json
 import os
-import re
 import shutil
 import sys
 
-import pytest
-
 root_dir = os.path.join(os.path.dirname(__file__), "..")
 sys.path.insert(0, root_dir)
 
+from subprocess import CompletedProcess  # noqa: E402
+
 from version import exec  # noqa: E402
 
-git_repo = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.local/testgit"))
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 
+def _checkout(git_repo, target) -> CompletedProcess:
+    """
+    Checks out a branch, or detaches HEAD at a commit, in-process with pygit2
+    """
+    repo = pygit2.Repository(git_repo)
+    branch = repo.lookup_branch(target)
+    if branch is not None:
+        repo.checkout(branch)
+    else:
+        # annotated tags resolve to the tag object, HEAD has to point at the commit
+        commit = repo.revparse_single(target).peel(pygit2.Commit)
+        repo.checkout_tree(commit)
+        repo.set_head(commit.id)
+    return CompletedProcess(args=["checkout", target], returncode=0, stdout="", stderr="")
 
-def git(cmd):
+
+def git(git_repo, cmd):
+    # switching branches is most of what the tests do, skip spawning git for it when pygit2 is installed
+    op, _, target = cmd.partition(" ")
+    if pygit2 is not None and op in ("switch", "checkout") and target and " " not in target:
+        return _checkout(git_repo, target)
     return exec(f'git -C "{git_repo}" {cmd}', capture=True)
 
 
-def init_git():
+def init_git(git_repo):
     # Setup main and a single branch
     # (main) 0.1.0 -> 0.2.0 -> 0.3.0
     #                    \
@@ -27,34 +52,36 @@ def init_git():
     exec(f'git init -b main "{git_repo}"', capture=True)
     exec(f"git -C {git_repo} config user.name 'test'", capture=True)
     exec(f"git -C {git_repo} config user.email 'test@home.com'", capture=True)
+    exec(f"git -C {git_repo} config core.commitGraph true", capture=True)
+    exec(f"git -C {git_repo} config gc.writeCommitGraph true", capture=True)
     # add readme, commit and tag
     exec(f"touch {git_repo}/README.md", capture=True)
     exec(f"git -C {git_repo} add -A", capture=True)
     exec(f"git -C {git_repo} commit -m 'add readme'", capture=True)
     exec(f"git -C {git_repo} tag 0.1.0", capture=True)
     exec(f"git -C {git_repo} tag myservice-v0.1.0", capture=True)
-    main_1 = git("rev-parse HEAD").stdout.strip()
-    main_1_tags = ",".join(git(f"tag --points-at {main_1}").stdout.strip().splitlines())
+    main_1 = git(git_repo, "rev-parse HEAD").stdout.strip()
+    main_1_tags = ",".join(git(git_repo, f"tag --points-at {main_1}").stdout.strip().splitlines())
     # add change1, commit and tag
     exec(f"touch {git_repo}/change-one.md", capture=True)
     exec(f"git -C {git_repo} add -A", capture=True)
     exec(f"git -C {git_repo} commit -m 'add change-one'", capture=True)
     exec(f"git -C {git_repo} tag 0.2.0", capture=True)
     exec(f"git -C {git_repo} tag myservice-v0.2.0", capture=True)
-    main_2 = git("rev-parse HEAD").stdout.strip()
-    main_2_tags = ",".join(git(f"tag --points-at {main_2}").stdout.strip().splitlines())
+    main_2 = git(git_repo, "rev-parse HEAD").stdout.strip()
+    main_2_tags = ",".join(git(git_repo, f"tag --points-at {main_2}").stdout.strip().splitlines())
     # add branch and add a few commits
     exec(f"git -C {git_repo} checkout -b chore/branch1", capture=True)
     exec(f"touch {git_repo}/branch-change-one.md", capture=True)
     exec(f"git -C {git_repo} add -A", capture=True)
     exec(f"git -C {git_repo} commit -m 'add branch-change-one'", capture=True)
-    branch_1 = git("rev-parse HEAD").stdout.strip()
-    branch_1_tags = ",".join(git(f"tag --points-at {branch_1}").stdout.strip().splitlines())
+    branch_1 = git(git_repo, "rev-parse HEAD").stdout.strip()
+    branch_1_tags = ",".join(git(git_repo, f"tag --points-at {branch_1}").stdout.strip().splitlines())
     exec(f"touch {git_repo}/branch-change-two.md", capture=True)
     exec(f"git -C {git_repo} add -A", capture=True)
     exec(f"git -C {git_repo} commit -m 'add branch-change-two'", capture=True)
-    branch_2 = git("rev-parse HEAD").stdout.strip()
-    branch_2_tags = ",".join(git(f"tag --points-at {branch_1}").stdout.strip().splitlines())
+    branch_2 = git(git_repo, "rev-parse HEAD").stdout.strip()
+    branch_2_tags = ",".join(git(git_repo, f"tag --points-at {branch_1}").stdout.strip().splitlines())
     # switch back to main add change2, commit and tag
     exec(f"git -C {git_repo} switch main", capture=True)
     exec(f"touch {git_repo}/change-two.md", capture=True)
@@ -62,10 +89,12 @@ def init_git():
     exec(f"git -C {git_repo} commit -m 'add change-two'", capture=True)
     exec(f"git -C {git_repo} tag 0.3.0", capture=True)
     exec(f"git -C {git_repo} tag myservice-v0.3.0", capture=True)
-    main_3 = git("rev-parse HEAD").stdout.strip()
-    main_3_tags = ",".join(git(f"tag --points-at {main_3}").stdout.strip().splitlines())
-    git("checkout -b dev/some-name/jira-1234-this-is-a-really-cool-feature-i-think")
-    #git("switch main")
+    main_3 = git(git_repo, "rev-parse HEAD").stdout.strip()
+    main_3_tags = ",".join(git(git_repo, f"tag --points-at {main_3}").stdout.strip().splitlines())
+    git(git_repo, "checkout -b dev/some-name/jira-1234-this-is-a-really-cool-feature-i-think")
+    #git(git_repo, "switch main")
+    # every copy of the repo gets the commit-graph so rev-list/describe dont have to parse commits
+    exec(f"git -C {git_repo} commit-graph write --reachable --changed-paths", capture=True)
 
     return {
         "main_1": main_1,
@@ -79,3 +108,40 @@ def init_git():
         "branch_2": branch_2,
         "branch_2_tags": branch_2_tags,
     }
+
+
+def _init_git_cache_dir():
+    # a change to init_git or a different git (commit-graph format etc) gets a new cache entry
+    git_version = exec("git --version", capture=True).stdout.strip()
+    source = inspect.getsource(init_git)
+    key = hashlib.sha256(f"{git_version}\n{source}".encode()).hexdigest()[:16]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "python-version-tests", key)
+
+
+def cached_init_git(git_repo):
+    """
+    Same as init_git but the built repo and hashes are kept under ~/.cache so later sessions only copy them
+    """
+    cache_dir = _init_git_cache_dir()
+    hashes_file = os.path.join(cache_dir, "hashes.json")
+    if not os.path.exists(hashes_file):
+        try:
+            os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        except OSError:
+            return init_git(git_repo)
+        # build next to the cache entry and rename it into place, xdist workers can race here
+        staging = f"{cache_dir}.{os.getpid()}"
+        hashes = init_git(os.path.join(staging, "repo"))
+        with open(os.path.join(staging, "hashes.json"), "w") as f:
+            json.dump(hashes, f)
+        try:
+            os.rename(staging, cache_dir)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    if os.path.exists(git_repo):
+        shutil.rmtree(git_repo)
+    shutil.copytree(os.path.join(cache_dir, "repo"), git_repo, symlinks=True)
+    with open(hashes_file) as f:
+        return json.load(f)
@@ -0,0 +1,49 @@
+import shutil
+
+import pytest
+
+from tests import configure
+from version import VersionContext, VersionIncrement
+
+
+@pytest.fixture(autouse=True)
+def _clean_env(monkeypatch):
+    """
+    Tests run the same in and out of github actions, set GITHUB_HEAD_REF with monkeypatch where needed
+    """
+    monkeypatch.delenv("GITHUB_HEAD_REF", raising=False)
+
+
+@pytest.fixture(scope="session")
+def git_template(tmp_path_factory):
+    """
+    Builds the test repo once per session, or restores it from the cache of a previous session.
+    Returns the repo dir and the commit hashes (see init_git)
+    """
+    template = str(tmp_path_factory.mktemp("git-template") / "repo")
+    return template, configure.cached_init_git(template)
+
+
+@pytest.fixture(scope="session")
+def hashes(git_template):
+    return git_template[1]
+
+
+@pytest.fixture
+def git_repo(git_template, tmp_path):
+    """
+    A private copy of the template repo so tests can switch branches without affecting each other
+    """
+    repo = str(tmp_path / "repo")
+    shutil.copytree(git_template[0], repo, symlinks=True)
+    return repo
+
+
+@pytest.fixture
+def git(git_repo):
+    return lambda cmd: configure.git(git_repo, cmd)
+
+
+@pytest.fixture
+def ctx(git_repo):
+    return VersionContext(increment=VersionIncrement.MINOR, work_tree=git_repo)
@@ -0,0 +1,115 @@
+import enum
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+import __task__
+from __tasklib__ import SystemContext, TaskContext
+
+
+def _task_ctx(project_dir):
+    return TaskContext(
+        root_dir=project_dir,
+        project_dir=project_dir,
+        log=logging.getLogger("test"),
+        system=SystemContext(platform="linux", arch="x86_64", distro=""),
+    )
+
+
+def test_ci_version(git_repo, git, tmp_path, monkeypatch):
+    """
+    Tests the ci:version:* tasks write the env file for the repo in the cwd
+    """
+    build_env = tmp_path / "out" / "build-env"
+    monkeypatch.setattr(__task__, "BUILD_ENV_FILE", str(build_env))
+    monkeypatch.chdir(git_repo)
+    git("switch main")
+
+    __task__._ci_version(_task_ctx(git_repo), "minor")
+    lines = build_env.read_text().splitlines()
+    assert 'VERSION_SEMVER="0.3.0"' in lines
+    assert 'VERSION_LAST_TAG="0.2.0"' in lines
+
+    __task__._ci_version(_task_ctx(git_repo), "patch")
+    assert 'VERSION_SEMVER="0.2.1"' in build_env.read_text().splitlines()
+
+
+def test_watch_finds_new_and_deleted_test_files(tmp_path, monkeypatch):
+    """
+    Tests the cached test file list is refreshed when files are added or deleted
+    """
+
+    class Change(enum.IntEnum):
+        added = 1
+        modified = 2
+        deleted = 3
+
+    tests_dir = tmp_path / "tests"
+    tests_dir.mkdir()
+    (tests_dir / "test_a.py").touch()
+    monkeypatch.chdir(tmp_path)
+    __task__._find_test_files.cache_clear()
+
+    new_file = os.path.abspath("tests/test_b.py")
+
+    def watch(path, watch_filter=None):
+        (tests_dir / "test_b.py").touch()
+        yield {(Change.added, new_file)}
+        yield {(Change.modified, new_file)}
+        (tests_dir / "test_b.py").unlink()
+        yield {(Change.deleted, new_file)}
+
+    watchfiles = types.SimpleNamespace(Change=Change, PythonFilter=object, watch=watch)
+    monkeypatch.setitem(sys.modules, "watchfiles", watchfiles)
+    monkeypatch.delenv("WATCH_BACKEND", raising=False)
+
+    runs = []
+
+    def on_change(changes):
+        files = __task__._find_test_files(__task__.TEST_FILES_PATTERN)
+        runs.append((__task__._changed_test_files(changes), sorted(files)))
+
+    __task__._watch(_task_ctx(str(tmp_path)), [], on_change)
+    __task__._find_test_files.cache_clear()
+
+    # the full suite first, then the new file on its own. once it's deleted, it's no
+    # longer a test file so the full suite runs without it
+    test_a, test_b = "./tests/test_a.py", "./tests/test_b.py"
+    assert runs == [
+        (None, [test_a]),
+        (["tests/test_b.py"], [test_a, test_b]),
+        (["tests/test_b.py"], [test_a, test_b]),
+        (None, [test_a]),
+    ]
+
+
+def test_test_task(tmp_path, monkeypatch, capsys):
+    """
+    Tests shard output is written with a prefix per shard and a failed shard fails the
+    task
+    """
+
+    def pytest_argv(nodeids):
+        code = "print('ran', *sys.argv[1:]); sys.exit(sys.argv[1] == 'b')"
+        return [sys.executable, "-c", f"import sys; {code}", *nodeids]
+
+    monkeypatch.setattr(__task__, "_get_pytest_argv", pytest_argv)
+    shards = [["a"], ["b"]]
+    monkeypatch.setattr(__task__, "_shard_nodeids", lambda ctx, n, files: shards)
+
+    assert __task__._run_tests(_task_ctx(str(tmp_path))) == [1]
+    out = capsys.readouterr().out.splitlines()
+    assert sorted(out) == ["[0] ran a", "[1] ran b"]
+
+    with pytest.raises(SystemExit) as ex:
+        __task__._test(_task_ctx(str(tmp_path)))
+    assert ex.value.code == 1
+    capsys.readouterr()
+
+    # a single shard isn't prefixed and passes
+    monkeypatch.setattr(__task__, "_shard_nodeids", lambda ctx, n, files: [["a"]])
+    __task__._test(_task_ctx(str(tmp_path)))
+    assert capsys.readouterr().out == "ran a\n"
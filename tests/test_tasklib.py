@@ -0,0 +1,372 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import __tasklib__
+from __tasklib__ import TaskDefinition, load_dotenv
+
+DOTENV_KEYS = [
+    "TL_A",
+    "TL_B",
+    "TL_C",
+    "TL_DUP",
+    "TL_QUOTED",
+    "TL.DOTTED",
+]
+
+
+@pytest.fixture
+def dotenv(tmp_path, monkeypatch):
+    """
+    Writes a .env file and returns its path. The keys used by the tests are cleared and
+    restored afterwards
+    """
+    for k in DOTENV_KEYS:
+        monkeypatch.delenv(k, raising=False)
+
+    def write(content):
+        path = tmp_path / ".env"
+        path.write_text(content)
+        return str(path)
+
+    return write
+
+
+def test_load_dotenv(dotenv):
+    load_dotenv(dotenv("# comment\n\n  TL_A = one  \nnot a key value\nTL.DOTTED=two\n"))
+    assert os.environ["TL_A"] == "one"
+    assert os.environ["TL.DOTTED"] == "two"
+
+
+def test_load_dotenv_line_endings(dotenv):
+    """
+    Tests windows line endings, = in values and lines with an empty key
+    """
+    load_dotenv(dotenv("TL_A=one\r\nTL_B = x=y\r\n=skipped\r\n  # TL_C=comment\r\n"))
+    assert os.environ["TL_A"] == "one"
+    assert os.environ["TL_B"] == "x=y"
+    assert "TL_C" not in os.environ
+    assert "" not in os.environ
+
+
+def test_load_dotenv_missing_file(tmp_path):
+    load_dotenv(str(tmp_path / "missing.env"))
+
+
+def test_load_dotenv_duplicates(dotenv):
+    """
+    Without override the first value wins, like an existing env var. With override the
+    last does
+    """
+    path = dotenv("TL_DUP=first\nTL_DUP=second\n")
+    load_dotenv(path)
+    assert os.environ["TL_DUP"] == "first"
+
+    load_dotenv(path, override=True)
+    assert os.environ["TL_DUP"] == "second"
+
+
+def test_load_dotenv_override(dotenv, monkeypatch):
+    monkeypatch.setenv("TL_A", "existing")
+    path = dotenv("TL_A=from-file\n")
+    load_dotenv(path)
+    assert os.environ["TL_A"] == "existing"
+
+    load_dotenv(path, override=True)
+    assert os.environ["TL_A"] == "from-file"
+
+
+def test_load_dotenv_quotes(dotenv):
+    """
+    Quotes are part of the value
+    """
+    load_dotenv(dotenv("TL_QUOTED=\"a b\"\nTL_A='c'\n"))
+    assert os.environ["TL_QUOTED"] == '"a b"'
+    assert os.environ["TL_A"] == "'c'"
+
+
+def test_load_dotenv_expand_vars(dotenv, monkeypatch):
+    monkeypatch.setenv("TL_C", "env")
+    load_dotenv(dotenv("TL_A=${TL_C}/$TL_B/$TL_UNKNOWN\nTL_B=later\n"))
+    # keys further down the file and existing env vars are expanded, unknown ones are
+    # kept
+    assert os.environ["TL_A"] == "env/later/$TL_UNKNOWN"
+
+    load_dotenv(dotenv("TL_A=$TL_C\n"), override=True, expand_vars=False)
+    assert os.environ["TL_A"] == "$TL_C"
+
+
+def test_load_dotenv_expand_vars_only_loaded(dotenv, monkeypatch):
+    """
+    Env vars that weren't loaded from the file are left as they are
+    """
+    monkeypatch.setenv("TL_B", "$TL_A")
+    load_dotenv(dotenv("TL_A=one\n"))
+    assert os.environ["TL_B"] == "$TL_A"
+
+
+def _tasks(ran, funcs=None, **deps):
+    """
+    Builds fake task definitions, each one records its name in ran when it runs
+    """
+    funcs = funcs or {}
+    lock = threading.Lock()
+
+    def record(name):
+        def func(ctx):
+            funcs.get(name, lambda: None)()
+            with lock:
+                ran.append(name)
+
+        return func
+
+    return {
+        name: TaskDefinition(
+            func=record(name), module="test", name=name, filename="", dir="", deps=d
+        )
+        for name, d in deps.items()
+    }
+
+
+def _assert_deps_ran_first(ran, tasks):
+    for name in ran:
+        for dep in tasks[name].deps:
+            assert ran.index(dep) < ran.index(name)
+
+
+@pytest.mark.parametrize("cpu_count", [None, 1, 2, 3, 8])
+def test_run_tasks_order(cpu_count, monkeypatch):
+    """
+    Tests dependencies finish before their dependents, whatever the number of workers
+    """
+    monkeypatch.setattr(__tasklib__.os, "cpu_count", lambda: cpu_count)
+    ran = []
+    tasks = _tasks(ran, a=[], b=["a"], c=["a"], d=["b", "c"], e=[])
+    __tasklib__._run_tasks(["a", "b", "c", "d", "e", "unknown"], tasks)
+    assert sorted(ran) == ["a", "b", "c", "d", "e"]
+    _assert_deps_ran_first(ran, tasks)
+
+
+def test_run_tasks_concurrently(monkeypatch):
+    """
+    Tests independent tasks run at the same time, the barrier is only passed if both
+    are running
+    """
+    monkeypatch.setattr(__tasklib__.os, "cpu_count", lambda: 4)
+    barrier = threading.Barrier(2, timeout=5)
+    ran = []
+    funcs = {"a": barrier.wait, "b": barrier.wait}
+    tasks = _tasks(ran, funcs, a=[], b=[], c=["a", "b"])
+    __tasklib__._run_tasks(["a", "b", "c"], tasks)
+    assert ran[-1] == "c"
+
+
+def test_run_tasks_single_worker(monkeypatch):
+    """
+    Tests tasks run one at a time when there is only one worker (cpu_count() <= 2)
+    """
+    monkeypatch.setattr(__tasklib__.os, "cpu_count", lambda: 2)
+    running = []
+    overlapped = []
+
+    def work():
+        running.append(1)
+        overlapped.append(len(running) > 1)
+        threading.Event().wait(0.01)
+        running.pop()
+
+    ran = []
+    tasks = _tasks(ran, {"a": work, "b": work, "c": work}, a=[], b=[], c=["a", "b"])
+    __tasklib__._run_tasks(["a", "b", "c"], tasks)
+    assert sorted(ran) == ["a", "b", "c"]
+    assert not any(overlapped)
+
+
+@pytest.mark.parametrize("cpu_count", [2, 8])
+def test_run_tasks_failure(cpu_count, monkeypatch):
+    """
+    Tests a failing task stops its dependents from running and the error is raised
+    """
+    monkeypatch.setattr(__tasklib__.os, "cpu_count", lambda: cpu_count)
+
+    def fail():
+        raise RuntimeError("task failed")
+
+    ran = []
+    tasks = _tasks(ran, {"a": fail}, a=[], b=["a"], c=["b"], d=[])
+    with pytest.raises(RuntimeError, match="task failed"):
+        __tasklib__._run_tasks(["a", "b", "c", "d"], tasks)
+    assert "b" not in ran and "c" not in ran
+
+
+def test_run_tasks_exit_code(tmp_path):
+    """
+    Tests running a failing task from the command line exits non-zero
+    """
+    (tmp_path / "__task__.py").write_text(
+        "def _fail(ctx):\n"
+        "    raise RuntimeError('task failed')\n"
+        "\n"
+        "def configure(builder):\n"
+        "    builder.add_task('test', 'ok', lambda ctx: None)\n"
+        "    builder.add_task('test', 'fail', _fail)\n"
+        "    after = lambda ctx: print('after')\n"
+        "    builder.add_task('test', 'after', after, deps=['fail'])\n"
+    )
+    tasklib = os.path.abspath(__tasklib__.__file__)
+
+    ret = subprocess.run(
+        [sys.executable, tasklib, "ok"], cwd=tmp_path, capture_output=True
+    )
+    assert ret.returncode == 0
+
+    ret = subprocess.run(
+        [sys.executable, tasklib, "after"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert ret.returncode != 0
+    assert "task failed" in ret.stderr
+    assert "after" not in ret.stdout
+
+
+def test_resolve_deps_diamond():
+    """
+    Tests shared dependencies are only returned once, before everything that needs them
+    """
+    tasks = _tasks([], a=[], b=["a"], c=["a"], d=["b", "c"])
+    assert __tasklib__._resolve_deps(["d"], tasks) == ["a", "b", "c", "d"]
+    assert __tasklib__._resolve_deps(["c", "d", "a"], tasks) == ["a", "c", "b", "d"]
+
+
+def test_resolve_deps_cycle():
+    tasks = _tasks([], a=["c"], b=["a"], c=["b"])
+    with pytest.raises(ValueError, match="Circular dependency detected"):
+        __tasklib__._resolve_deps(["a"], tasks)
+
+    tasks = _tasks([], a=["a"])
+    with pytest.raises(ValueError, match="Circular dependency detected"):
+        __tasklib__._resolve_deps(["a"], tasks)
+
+
+def test_resolve_deps_unknown():
+    """
+    Tests an unknown dependency resolves like a task without deps, _run_tasks skips it
+    """
+    ran = []
+    tasks = _tasks(ran, a=["missing"], b=["a"])
+    resolved = __tasklib__._resolve_deps(["b"], tasks)
+    assert resolved == ["missing", "a", "b"]
+
+    __tasklib__._run_tasks(resolved, tasks)
+    assert ran == ["a", "b"]
+
+
+def test_load_task_definition_dataclass(tmp_path):
+    """
+    Tests task files can define dataclasses, they need the module in sys.modules
+    """
+    task_file = tmp_path / "__task__.py"
+    task_file.write_text(
+        "from __future__ import annotations\n"
+        "\n"
+        "from dataclasses import dataclass\n"
+        "\n"
+        "\n"
+        "@dataclass\n"
+        "class Options:\n"
+        "    name: str = 'test'\n"
+        "\n"
+        "\n"
+        "def configure(builder):\n"
+        "    builder.add_task('test', 'options', lambda ctx: Options())\n"
+    )
+    task_def = __tasklib__._load_task_definition(1000, str(task_file))
+    try:
+        assert task_def is not None
+        assert task_def.dir == str(tmp_path)
+        assert "options" in __tasklib__._load_tasks(task_def)
+    finally:
+        sys.modules.pop("task1000", None)
+
+
+def test_find_task_files_unreadable_dir(tmp_path, monkeypatch):
+    """
+    Tests directories that can't be read are skipped instead of stopping the search
+    """
+    for d in ["a", "locked", "locked/b", "c"]:
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "__task__.py").touch()
+    monkeypatch.chdir(tmp_path)
+
+    scandir = os.scandir
+
+    def locked_scandir(path):
+        if os.path.basename(path) == "locked":
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+
+    monkeypatch.setattr(__tasklib__.os, "scandir", locked_scandir)
+    assert __tasklib__._find_task_files() == ["a/__task__.py", "c/__task__.py"]
+
+
+def test_run_tasks_start_order(monkeypatch):
+    """
+    Tests independent tasks are started in the resolved (command line) order
+    """
+    monkeypatch.setattr(__tasklib__.os, "cpu_count", lambda: 2)
+    ran = []
+    tasks = _tasks(ran, a=[], b=[], c=[], d=["a"])
+    __tasklib__._run_tasks(["c", "a", "b", "d"], tasks)
+    assert ran == ["c", "a", "b", "d"]
+
+
+def test_run_tasks_interrupt(tmp_path):
+    """
+    Tests ctrl-c exits while tasks that never return (ie. watch loops) are running
+    """
+    (tmp_path / "__task__.py").write_text(
+        "import time\n"
+        "\n"
+        "def _loop(ctx):\n"
+        "    print('started', flush=True)\n"
+        "    while True:\n"
+        "        time.sleep(0.1)\n"
+        "\n"
+        "def configure(builder):\n"
+        "    builder.add_task('test', 'loop1', _loop)\n"
+        "    builder.add_task('test', 'loop2', _loop)\n"
+    )
+    tasklib = os.path.abspath(__tasklib__.__file__)
+    proc = subprocess.Popen(
+        [sys.executable, tasklib, "loop1", "loop2"],
+        cwd=tmp_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    try:
+        # loop2 only starts as well when there is more than one worker
+        assert proc.stdout.readline() == "started\n"
+        proc.send_signal(signal.SIGINT)
+        assert proc.wait(timeout=10) is not None
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+
+
+def test_exec_args():
+    """
+    Tests strings are split with shlex, lists and tuples are passed through as is
+    """
+    assert __tasklib__.exec("echo 'a b'", capture=True).stdout == "a b\n"
+    assert __tasklib__.exec(["echo", "a  b"], capture=True).stdout == "a  b\n"
+    ret = __tasklib__.exec(("echo", "a  b"), capture=True)
+    assert ret.returncode == 0
+    assert ret.stdout == "a  b\n"
@@ -1,15 +1,19 @@
-import os
-import re
-from datetime import datetime
+import json
+import shutil
+import time
+from dataclasses import replace
 
 import pytest
 
-from tests.configure import git, git_repo, init_git
-from version import (Version, VersionContext, VersionIncrement,
-                     apply_tag_prefix, build_nuget, build_pep440, build_semver,
-                     build_tag, build_version_components, exec, get_branch,
-                     get_commit_count, get_detached_branch, get_github_branch,
-                     get_hash, get_last_tag, get_timestamp, get_version,
+from version import (DEFAULT_PIPELINE, Version, VersionBuilder, VersionContext,
+                     VersionIncrement, _GitSession, _git_session,
+                     _parse_describe, apply_tag_prefix, build_nuget,
+                     build_pep440, build_semver, build_tag,
+                     build_version_components, clear_version_caches, exec,
+                     get_branch, get_cached_version, get_commit_count,
+                     get_detached_branch, get_github_branch, get_hash,
+                     get_hash_and_branch, get_last_tag, get_pipeline,
+                     get_repo_snapshot, get_timestamp, get_version,
                      sanitize_branch_name, strip_branch_components,
                      validate_context, validate_semver,
                      validate_version_components)
@@ -19,7 +23,7 @@ from version import (Version, VersionContext, VersionIncrement,
 #                    \
 #               (chore/branch1) -> branch-change-one -> branch-change-two
 #
-# returns a dict with the commit hashes
+# the hashes fixture is a dict with the commit hashes
 # {
 #   main_1 : baf0ecc29174091053b64209d55d702dd70f1287   note: main, 0.1.0 | mysevice-v0.1.0
 #   main_2 : 705fa6edc2e529a0794a9f473e65502c4cd08c15   note: main, 0.2.0 | mysevice-v0.2.0
@@ -27,58 +31,130 @@ from version import (Version, VersionContext, VersionIncrement,
 #   branch_1 : 32ad125ad05fdcc12d3e2b2c8ca2134e408a3c5f note: chore/branch1, no tag, branched off 0.2.0
 #   branch_2 : 63e520ae66faaa16fc3d72ece793f59fc5b9a871 note: chore/branch1, no tag, branched off 0.2.0
 # }
-hashes = init_git()
-# for key in hashes:
-#    print(key, hashes[key])
-semver_rx = re.compile(r"\.")
 tag_prefix_data = [None, "myservice-v"]
 
 
-def default_context() -> VersionContext:
-    return VersionContext(increment=VersionIncrement.MINOR, work_tree=git_repo)
-
-
-def test_hash():
+def test_hash(ctx, git, hashes):
     """
     Test getting the hash of the current commit (main_3)
     """
     git("switch main")
-    c = default_context()
+    c = ctx
     v = Version()
     v = get_hash(c, v)
     assert v.hash == hashes["main_3"]
 
+    # the git session is reused, HEAD is resolved again on each call
+    git("switch chore/branch1")
+    v = get_hash(c, Version())
+    assert v.hash == hashes["branch_2"]
+
+
+def test_get_repo_snapshot(ctx, git, hashes):
+    """
+    Tests collecting the hash, branch and tags in one go
+    """
+    git("switch chore/branch1")
+    git(f"tag -a 0.2.1 -m 0.2.1 {hashes['main_2']}")
+    c = ctx
+    get_repo_snapshot(c, Version())
+    assert c.snapshot.hash == hashes["branch_2"]
+    assert c.snapshot.branch == "chore/branch1"
+    assert c.snapshot.tags["0.1.0"] == hashes["main_1"]
+    assert c.snapshot.tags["myservice-v0.3.0"] == hashes["main_3"]
+    # annotated tags resolve to the commit, not the tag object
+    assert c.snapshot.tags["0.2.1"] == hashes["main_2"]
+    # describe ran alongside, annotated 0.2.1 wins over 0.2.0 on the same commit
+    assert c.snapshot.describe == ("0.2.1", 1)
+
+    # detached
+    git(f"checkout {hashes['branch_1']}")
+    get_repo_snapshot(c, Version())
+    assert c.snapshot.hash == hashes["branch_1"]
+    assert c.snapshot.branch is None
+    assert get_branch(c, Version()).branch == "HEAD"
+
 
 @pytest.mark.parametrize("tag_prefix", tag_prefix_data)
-def test_get_last_tag(tag_prefix):
+def test_get_last_tag(tag_prefix, ctx, git, hashes):
     """
     Test getting the last tag of the current commit (main_3)
     Tag should be from main_2
     """
     git("switch main")
-    c = default_context()
-    c.tag_prefix = tag_prefix
+    c = replace(ctx, tag_prefix=tag_prefix)
     v = Version(hash=hashes["main_3"])
     v = get_last_tag(c, v)
     assert v.last_tag in ("0.2.0", "myservice-v0.2.0")
     assert v.last_hash == hashes["main_2"]
+    assert v.commits == 1
+
+
+def test_clear_version_caches(ctx, git, hashes):
+    """
+    Tests git lookups are cached until clear_version_caches() is called
+    """
+    git("switch main")
+    c = ctx
+    v = get_last_tag(c, Version(hash=hashes["main_3"]))
+    assert v.last_tag == "0.2.0"
+
+    git(f"tag -a 0.2.1 -m 0.2.1 {hashes['main_2']}")
+    v = get_last_tag(c, Version(hash=hashes["main_3"]))
+    assert v.last_tag == "0.2.0"
+
+    clear_version_caches()
+    v = get_last_tag(c, Version(hash=hashes["main_3"]))
+    assert v.last_tag == "0.2.1"
+    # annotated tag, hash is the commit not the tag object
+    assert v.last_hash == hashes["main_2"]
+
+
+def test_get_last_tag_merge_history(ctx, git, hashes, monkeypatch):
+    """
+    Tests commits are counted along the ancestry path from the tag when merges are involved
+    (main) 0.2.0 -> 0.3.0 -> merge -> after-merge
+    (side)    +-> side-one -> side-two -+
+    """
+    git("switch main")
+    git("checkout -b side 0.2.0")
+    git("commit --allow-empty -m side-one")
+    git("commit --allow-empty -m side-two")
+    git("switch main")
+    git("merge --no-ff -m merge side")
+    merge = git("rev-parse HEAD").stdout.strip()
+    git("commit --allow-empty -m after-merge")
+    after_merge = git("rev-parse HEAD").stdout.strip()
+
+    v = get_last_tag(ctx, Version(hash=merge))
+    assert v.last_tag == "0.3.0"
+    assert v.last_hash == hashes["main_3"]
+    assert v.commits == 1
+
+    # describe counts the side commits as well, they don't descend from 0.3.0
+    v = get_last_tag(ctx, Version(hash=after_merge))
+    assert v.last_tag == "0.3.0"
+    assert v.commits == 2
+
+    monkeypatch.setenv("GITHUB_HEAD_REF", "feat")
+    assert get_version(ctx).semver_full == "0.4.0-feat.2"
 
 
 def test_get_last_tag_validation():
     with pytest.raises(ValueError):
         v = Version()
         c = VersionContext(increment=VersionIncrement.MAJOR)
-        c.hash = None
+        v.hash = None
         v = get_last_tag(c, v)
 
 
 @pytest.mark.parametrize("tag", ["0.2.0", "myservice-v0.2.0"])
-def test_get_commit_count(tag):
+def test_get_commit_count(tag, ctx, git):
     """
     Test getting the commit count of the current commit (main_3)
     """
     git("switch chore/branch1")
-    c = default_context()
+    c = ctx
     v = Version(last_tag=tag)
     v = get_commit_count(c, v)
     assert v.commits == 2
@@ -93,15 +169,14 @@ def test_get_commit_count(tag):
 
 
 @pytest.mark.parametrize("tag_prefix", tag_prefix_data)
-def test_apply_tag_prefix(tag_prefix):
+def test_apply_tag_prefix(tag_prefix, ctx, git):
     """
     Tests stripping the tag prefix from the last_tag if there is one
     """
     last_tag = "0.2.0" if tag_prefix is None else "myservice-v0.2.0"
 
     git("switch chore/branch1")
-    c = default_context()
-    c.tag_prefix = tag_prefix
+    c = replace(ctx, tag_prefix=tag_prefix)
     v = Version(last_tag=last_tag)
     v = apply_tag_prefix(c, v)
     assert v.last_tag == last_tag
@@ -112,7 +187,7 @@ def test_apply_tag_prefix_validation():
     with pytest.raises(ValueError):
         v = Version()
         c = VersionContext(increment=VersionIncrement.MAJOR)
-        c.last_tag = None
+        v.last_tag = None
         v = apply_tag_prefix(c, v)
 
 
@@ -120,14 +195,14 @@ def test_build_version_validation():
 
     with pytest.raises(ValueError):
         v = Version()
-        c = default_context()
-        c.last_tag = None
+        c = VersionContext(increment=VersionIncrement.MINOR)
+        v.last_tag = None
         v = build_version_components(c, v)
 
     with pytest.raises(ValueError):
         v = Version()
-        c = default_context()
-        c.last_tag = "   "
+        c = VersionContext(increment=VersionIncrement.MINOR)
+        v.last_tag = "   "
         v = build_version_components(c, v)
 
     with pytest.raises(ValueError):
@@ -150,6 +225,21 @@ def test_build_version_validation():
         v = Version(last_tag="hello-v1.2.c", tag_prefix="hello-v")
         v = build_version_components(c, v)
 
+    with pytest.raises(ValueError):
+        c = VersionContext(increment=VersionIncrement.MAJOR)
+        v = Version(last_tag="hello-v1.2.3.4", tag_prefix="hello-v")
+        v = build_version_components(c, v)
+
+    with pytest.raises(ValueError):
+        c = VersionContext(increment=VersionIncrement.MAJOR)
+        v = Version(last_tag="hello-v1.2", tag_prefix="hello-v")
+        v = build_version_components(c, v)
+
+    with pytest.raises(ValueError):
+        c = VersionContext(increment=VersionIncrement.MAJOR)
+        v = Version(last_tag="hello-v1.2.+3", tag_prefix="hello-v")
+        v = build_version_components(c, v)
+
 
 def test_build_version_major():
     """
@@ -187,39 +277,45 @@ def test_build_version_patch():
     assert v.patch == 4
 
 
-def test_get_github_branch():
+def test_get_github_branch(monkeypatch):
     """
     Tests getting the branch from the GITHUB_HEAD_REF environment variable
     """
-    c = default_context()
+    c = VersionContext(increment=VersionIncrement.MINOR)
     v = Version()
 
-    github_head_ref = None
-
-    # test without GITHUB_HEAD_REF
-    # if we are running this test in github actions, GITHUB_HEAD_REF will be set
-    if "GITHUB_HEAD_REF" in os.environ:
-        github_head_ref = os.environ["GITHUB_HEAD_REF"]
-        del os.environ["GITHUB_HEAD_REF"]
+    # test without GITHUB_HEAD_REF (the _clean_env fixture removes it)
     branch = get_github_branch(c, v).branch
     assert branch is None
 
     # test with GITHUB_HEAD_REF
-    os.environ["GITHUB_HEAD_REF"] = "foo/bar/baz"
+    monkeypatch.setenv("GITHUB_HEAD_REF", "foo/bar/baz")
     branch = get_github_branch(c, v).branch
     assert branch == "foo/bar/baz"
-    del os.environ["GITHUB_HEAD_REF"]
 
-    # set it back if it was set
-    if github_head_ref is not None:
-        os.environ["GITHUB_HEAD_REF"] = github_head_ref
 
+def test_happy_path_integration_github_branch(ctx, git, monkeypatch):
+    """
+    Tests GITHUB_HEAD_REF wins over the checked out branch, unless it's empty
+    """
+    git("switch main")
+    monkeypatch.setenv("GITHUB_HEAD_REF", "feature/pr-1")
+    v = get_version(ctx)
+    assert v.branch == "feature-pr-1"
+    assert v.semver_full == "0.3.0-feature-pr-1.1"
+
+    # set but empty for non pull request events
+    monkeypatch.setenv("GITHUB_HEAD_REF", "")
+    v = get_version(ctx)
+    assert v.branch == "main"
+    assert v.semver_full == "0.3.0"
 
-def test_get_branch():
+
+def test_get_branch(ctx, git):
     """
     Tests getting the branch from the git repository if it was not already set
     """
-    c = default_context()
+    c = ctx
     v = Version()
 
     # test with branch set
@@ -235,8 +331,46 @@ def test_get_branch():
     assert branch == "chore/branch1"
 
 
-def test_get_detached_branch():
-    c = default_context()
+def test_get_hash_and_branch(ctx, git, hashes):
+    """
+    Tests getting the hash and branch in one step, with and without a snapshot
+    """
+    git("switch chore/branch1")
+    c = ctx
+    v = get_hash_and_branch(c, Version())
+    assert v.hash == hashes["branch_2"]
+    assert v.branch == "chore/branch1"
+
+    # an existing branch (GITHUB_HEAD_REF) wins
+    v = get_hash_and_branch(c, Version(branch="foo/bar/baz"))
+    assert v.hash == hashes["branch_2"]
+    assert v.branch == "foo/bar/baz"
+
+    # detached
+    git(f"checkout {hashes['branch_1']}")
+    v = get_hash_and_branch(c, Version())
+    assert v.hash == hashes["branch_1"]
+    assert v.branch == "HEAD"
+
+    get_repo_snapshot(c, Version())
+    v = get_hash_and_branch(c, Version())
+    assert v.hash == hashes["branch_1"]
+    assert v.branch == "HEAD"
+
+
+def test_checkout_annotated_tag(ctx, git, hashes):
+    """
+    Tests checking out an annotated tag detaches HEAD at the commit, not the tag object
+    """
+    git(f"tag -a 0.2.1 -m 0.2.1 {hashes['main_2']}")
+    git("checkout 0.2.1")
+    assert git("cat-file -t HEAD").stdout.strip() == "commit"
+    assert git("rev-parse HEAD").stdout.strip() == hashes["main_2"]
+    assert get_hash(ctx, Version()).hash == hashes["main_2"]
+
+
+def test_get_detached_branch(ctx, git, hashes):
+    c = ctx
     v = Version()
     v.hash = hashes["branch_2"]
 
@@ -253,6 +387,19 @@ def test_get_detached_branch():
     v = get_detached_branch(c, v)
     assert v.branch == "chore/branch1"
 
+    # same using the snapshot
+    get_repo_snapshot(c, Version())
+    assert c.snapshot.branches["chore/branch1"] == hashes["branch_2"]
+    v.branch = "HEAD"
+    v = get_detached_branch(c, v)
+    assert v.branch == "chore/branch1"
+
+    # not a branch tip, a new context has no snapshot
+    c = replace(ctx)
+    git(f"checkout {hashes['branch_1']}")
+    v = get_detached_branch(c, Version(branch="HEAD", hash=hashes["branch_1"]))
+    assert v.branch == "chore/branch1"
+
     with pytest.raises(ValueError):
         v.branch = None
         v.hash = hashes["main_3"]
@@ -275,7 +422,7 @@ def test_get_detached_branch():
 
 
 def test_sanitize_branch_name():
-    c = default_context()
+    c = VersionContext(increment=VersionIncrement.MINOR)
     v = Version()
 
     # test with a branch name that is already sanitized
@@ -286,6 +433,11 @@ def test_sanitize_branch_name():
     # test with a branch name that offensive
     v.branch = "main/one/two-three"
     v = sanitize_branch_name(c, v)
+    assert v.branch == "main-one-two-three"
+
+    v.branch = "dev/jira_1234.fix#2ü"
+    v = sanitize_branch_name(c, v)
+    assert v.branch == "dev-jira-1234-fix-2-"
 
     with pytest.raises(ValueError):
         v.branch = None
@@ -297,7 +449,7 @@ def test_sanitize_branch_name():
 
 
 def test_strip_branch_components():
-    c = default_context()
+    c = VersionContext(increment=VersionIncrement.MINOR)
     v = Version()
 
     # test with a branch name that offensive
@@ -327,6 +479,11 @@ def test_strip_branch_components():
         v.branch = "main"
         v = strip_branch_components(c, v)
 
+    with pytest.raises(ValueError, match="Cannot strip 2 components.*only 2 component"):
+        c.strip_branch_components = 2
+        v.branch = "dev/name"
+        v = strip_branch_components(c, v)
+
     # bug found in testing
     c.strip_branch_components = 0
     v.branch = "dev/name/jira-1234-do-something"
@@ -399,11 +556,35 @@ def test_build_tag():
 
 
 def test_build_pep440():
-    pass
+    c = VersionContext(increment=VersionIncrement.MINOR)
+    v = Version(major=1, minor=2, patch=3, commits=3, branch="main")
+    v = build_pep440(c, build_semver(c, v))
+    assert v.pep440 == "1.2.3"
+
+    v.branch = "feature-x"
+    v = build_pep440(c, build_semver(c, v))
+    assert v.semver_full == "1.2.3-feature-x.3"
+    assert v.pep440 == "1.2.3+feature-x.3"
 
 
 def test_build_nuget():
-    pass
+    c = VersionContext(increment=VersionIncrement.MINOR)
+    v = Version(major=1, minor=2, patch=3, commits=3, branch="main")
+    v = build_nuget(c, build_semver(c, v))
+    assert v.nuget == "1.2.3"
+
+    v.branch = "feature-x"
+    v = build_nuget(c, build_semver(c, v))
+    assert v.nuget == v.semver_full == "1.2.3-feature-x.3"
+
+    # nuget prerelease versions are capped at 20 chars
+    v.branch = "feature-a-much-longer-name"
+    v = build_nuget(c, build_semver(c, v))
+    assert v.nuget == "1.2.3-featger-name.3"
+    assert len(v.nuget) <= 20
+
+    with pytest.raises(ValueError):
+        build_nuget(c, Version(major=1, minor=2, patch=3))
 
 
 def test_build_apple():
@@ -411,15 +592,34 @@ def test_build_apple():
 
 
 def test_timestamp():
-    c = default_context()
+    c = VersionContext(increment=VersionIncrement.MINOR)
     v = Version()
-    v = get_timestamp(c, v)
 
-    unow = datetime.utcnow()
-    ts = datetime.strptime(v.timestamp, "%Y%m%dT%H%M%SZ")
+    # fixed width, so utc timestamps taken either side compare as strings
+    before = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    v = get_timestamp(c, v)
+    after = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
 
     assert v.timestamp is not None
-    assert (unow.timestamp() - ts.timestamp()) < 1.0
+    assert before <= v.timestamp <= after
+
+
+def test_version_increment():
+    """
+    Tests VersionIncrement keeps its enum shape while the pipeline works with plain strings
+    """
+    assert VersionIncrement("MINOR") is VersionIncrement.MINOR
+    assert VersionIncrement.MAJOR.value == "MAJOR"
+    assert list(VersionIncrement) == ["MAJOR", "MINOR", "PATCH"]
+    assert str(VersionIncrement.PATCH) == "PATCH"
+
+    builder = VersionBuilder().withIncrement(VersionIncrement("PATCH"))
+    assert type(builder.increment) is str and builder.increment == "PATCH"
+
+    for increment in ("PATCH", VersionIncrement.PATCH):
+        c = VersionContext(increment=increment)
+        v = validate_context(c, Version(last_tag="1.2.3"))
+        assert build_version_components(c, v).patch == 4
 
 
 def test_validate_context():
@@ -429,9 +629,8 @@ def test_validate_context():
         validate_context(c, v)
 
 
-def test_happy_path_integration_main_with_prefix():
-    c = default_context()
-    c.tag_prefix = "myservice-v"
+def test_happy_path_integration_main_with_prefix(ctx, git, hashes):
+    c = replace(ctx, tag_prefix="myservice-v")
     git("switch main")
     v = get_version(c)
     assert v.major == 0
@@ -450,9 +649,25 @@ def test_happy_path_integration_main_with_prefix():
     assert v.nuget == "0.3.0"
 
 
-def test_happy_path_integration_main_no_prefix():
-    c = default_context()
-    c.tag_prefix is None
+def test_get_version_reused_context(ctx, git, hashes):
+    """
+    Tests a context can be reused after the repo changes, the snapshot isn't kept on it
+    """
+    git("switch main")
+    v = get_version(ctx)
+    assert v.hash == hashes["main_3"]
+    assert ctx.snapshot is None
+
+    git("switch chore/branch1")
+    v = get_version(ctx)
+    assert v.hash == hashes["branch_2"]
+    assert v.branch == "chore-branch1"
+    assert v.last_tag == "0.2.0"
+
+
+def test_happy_path_integration_main_no_prefix(ctx, git, hashes):
+    c = ctx
+    assert c.tag_prefix is None
     git("switch main")
     v = get_version(c)
     assert v.major == 0
@@ -471,10 +686,8 @@ def test_happy_path_integration_main_no_prefix():
     assert v.nuget == "0.3.0"
 
 
-def test_happy_path_integration_long_branch():
-    c = default_context()
-    c.tag_prefix = "myservice-v"
-    c.strip_branch_components = 2
+def test_happy_path_integration_long_branch(ctx, git, hashes):
+    c = replace(ctx, tag_prefix="myservice-v", strip_branch_components=2)
     git("switch dev/some-name/jira-1234-this-is-a-really-cool-feature-i-think")
 
     v = get_version(c)
@@ -492,3 +705,176 @@ def test_happy_path_integration_long_branch():
     assert v.semver_full == "0.3.0-jira-1234-this-is-a-really-cool-feature-i-think.1"
     assert v.pep440 == "0.3.0+jira-1234-this-is-a-really-cool-feature-i-think.1"
     assert v.nuget == "0.3.0-jira-i-think.1"
+
+
+def test_get_cached_version(ctx, git, hashes, tmp_path, monkeypatch):
+    """
+    Tests the cached version is reused until the branch moves
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    c = ctx
+    git("switch chore/branch1")
+    v = get_cached_version(c)
+    assert v.hash == hashes["branch_2"]
+    assert v.semver_full == "0.3.0-chore-branch1.2"
+
+    # served from the cache, git isn't run
+    def fail(ctx):
+        raise AssertionError("get_version should not be called")
+
+    with monkeypatch.context() as m:
+        m.setattr("version.get_version", fail)
+        cached = get_cached_version(c)
+    assert cached.hash == hashes["branch_2"]
+    assert cached.semver_full == v.semver_full
+
+    # a new commit on the branch invalidates it
+    git("commit --allow-empty -m 'branch-change-three'")
+    v = get_cached_version(c)
+    assert v.commits == 3
+    assert v.semver_full == "0.3.0-chore-branch1.3"
+
+
+def test_get_cached_version_nested_tag(ctx, git, hashes, tmp_path, monkeypatch):
+    """
+    Tests a tag created under a prefix directory (refs/tags/svc/) invalidates the cache
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    c = replace(ctx, tag_prefix="svc/v")
+    git("switch main")
+    git("commit --allow-empty -m 'change-three'")
+    git(f"tag svc/v1.0.0 {hashes['main_2']}")
+    v = get_cached_version(c)
+    assert v.last_tag == "svc/v1.0.0"
+    assert v.semver == "1.1.0"
+
+    git(f"tag svc/v1.1.0 {hashes['main_3']}")
+    v = get_cached_version(c)
+    assert v.last_tag == "svc/v1.1.0"
+    assert v.semver == "1.2.0"
+
+
+def test_get_cached_version_other_fields(ctx, git, hashes, tmp_path, monkeypatch):
+    """
+    Tests a cache entry written with a different set of version fields is a miss
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    git("switch main")
+    get_cached_version(ctx)
+
+    (cache_file,) = (tmp_path / "cache" / "python-version").glob("*.json")
+    cache = json.loads(cache_file.read_text())
+    for entry in cache.values():
+        entry["version"]["removed_field"] = entry["version"].pop("nuget")
+    cache_file.write_text(json.dumps(cache))
+
+    v = get_cached_version(ctx)
+    assert v.hash == hashes["main_3"]
+    assert v.nuget == "0.3.0"
+
+
+def test_work_tree_with_spaces(git_repo, hashes, tmp_path):
+    """
+    git is run with argv lists so the work tree doesn't need quoting
+    """
+    work_tree = str(tmp_path / "my repo")
+    shutil.copytree(git_repo, work_tree, symlinks=True)
+    c = VersionContext(increment=VersionIncrement.MINOR, work_tree=work_tree)
+    v = get_version(c)
+    assert v.hash == hashes["main_3"]
+    assert v.last_tag == "0.2.0"
+
+
+def test_get_pipeline(ctx, git):
+    """
+    Tests only the format builders needed for --show are run
+    """
+    assert get_pipeline("all") == DEFAULT_PIPELINE
+    assert get_pipeline(None) == DEFAULT_PIPELINE
+
+    funcs = get_pipeline("nuget,hash")
+    assert build_semver in funcs and build_nuget in funcs
+    assert build_tag not in funcs and build_pep440 not in funcs
+
+    git("switch main")
+    v = get_version(ctx, funcs=get_pipeline("tag"))
+    assert v.tag == "0.3.0"
+    assert v.semver is None
+    assert v.nuget is None
+
+
+def test_parse_describe():
+    assert _parse_describe("0.2.0-2-g1234abc") == ("0.2.0", 2)
+    assert _parse_describe("myservice-v0.2.0-0-g1234abc") == ("myservice-v0.2.0", 0)
+
+    for out in ["0.2.0", "0.2.0-x-g1234abc", "0.2.0-2-1234abc", ""]:
+        with pytest.raises(ValueError, match="Unexpected git describe output"):
+            _parse_describe(out)
+
+
+def test_exec_failures():
+    """
+    Tests commands that can't be started return a failed result instead of raising
+    """
+    ret = exec([])
+    assert ret.returncode == 1
+
+    ret = exec(["python-version-no-such-command"], capture=True)
+    assert ret.returncode == 1
+    assert ret.stdout == ""
+
+    ret = exec("python-version-no-such-command --help", capture=True)
+    assert ret.returncode == 1
+
+
+def test_git_session_without_git(monkeypatch):
+    """
+    Tests a missing git binary fails lookups like a missing revision
+    """
+    monkeypatch.setattr("version._git_argv", lambda work_tree: ("/nonexistent/git",))
+    session = _GitSession()
+    assert session.resolve("HEAD") is None
+    session.close()
+
+
+def test_exec_capture():
+    """
+    Tests captured output is returned as strings, stderr included
+    """
+    ret = exec(["git", "--version"], capture=True)
+    assert ret.returncode == 0
+    assert ret.stdout.startswith("git version")
+    assert ret.stderr == ""
+
+    ret = exec(["git", "python-version-no-such-command"], capture=True)
+    assert ret.returncode != 0
+    assert ret.stdout == ""
+    assert "python-version-no-such-command" in ret.stderr
+
+
+def test_git_sessions_bounded(git_repo, hashes, tmp_path, monkeypatch):
+    """
+    Tests only a few git sessions are kept alive, the least recently used is closed
+    """
+    monkeypatch.setattr("version._GIT_SESSIONS_MAX", 2)
+    clear_version_caches()
+    contexts = []
+    for i in range(3):
+        work_tree = str(tmp_path / f"repo{i}")
+        shutil.copytree(git_repo, work_tree, symlinks=True)
+        contexts.append(VersionContext(increment="MINOR", work_tree=work_tree))
+
+    first = _git_session(contexts[0])
+    second = _git_session(contexts[1])
+    # using the first again makes the second the least recently used
+    assert _git_session(contexts[0]) is first
+    third = _git_session(contexts[2])
+
+    assert second.proc.poll() is not None
+    assert first.proc.poll() is None and third.proc.poll() is None
+    assert third.resolve("HEAD") == hashes["main_3"]
+
+    # an evicted repo gets a new session
+    assert _git_session(contexts[1]).resolve("HEAD") == hashes["main_3"]
+    assert first.proc.poll() is not None
+    clear_version_caches()
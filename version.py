@@ -4,6 +4,50 @@
 #
 # CHANGELOG
 #
+# Thu, Oct 15, 2026 - chore: build the timestamp with time.gmtime(), no more python version check for utcnow()
+#                   - chore: Version, VersionContext and RepoSnapshot are slotted dataclasses (python 3.10+)
+#                   - chore: resolve HEAD through one long running git cat-file process per work tree
+#                   - chore: run commands through posix_spawn() (absolute executable path, close_fds=False, no cwd)
+#                   - chore: strip branch components with str.partition()
+#                   - chore: get_hash_and_branch replaces get_hash and get_branch in the pipeline, one rev-parse for both
+#                   - chore: get_last_tag uses describe --long for the tag and commit count, get_commit_count is out of the pipeline
+#                   - chore: tag hashes are resolved through the git cat-file session instead of rev-list
+#                   - feat: --cache (or PYVERSION_CACHE=1) reuses the last result until HEAD, the branch or tags change
+#                   - chore: exec() takes an argv list, git calls no longer go through shlex. strings still work
+#                   - chore: detached HEAD checks branch tips (snapshot or for-each-ref --points-at) before branch --contains
+#                   - chore: the cli only runs the format builders for the fields in --show
+#                   - fix: GITHUB_HEAD_REF is read first in the pipeline and ignored when empty (non pull request events)
+#                   - chore: the git argv prefix is built once per work tree
+#                   - chore: DEFAULT_PIPELINE is a tuple
+#                   - chore: VERSION_FIELDS lists the fields once, --show is split once
+#                   - chore: exec(capture=True) only captures stdout, stderr is discarded
+#                   - fix: raise on unexpected git describe output instead of mis-splitting it
+#                   - chore: empty checks use str.isspace() instead of stripping a copy
+#                   - chore: parse the tag with two str.partition() calls
+#                   - chore: get_repo_snapshot runs describe alongside for-each-ref
+#                   - chore: increments are a dict lookup instead of an if/elif chain
+#                   - chore: _get_branch_full checks for main/master once
+#                   - chore: _git_out() runs git and returns stdout or None, no CompletedProcess juggling
+#                   - chore: argparse, json and hashlib are imported where they are used
+#                   - chore: env/csv output is built with one join, env prefix upper-cased once
+#                   - chore: tag parsing rejects tags that don't start with a digit before splitting
+#                   - chore: main/master are a module-level frozenset
+#                   - chore: required field checks go through one _require() helper, pep440/nuget no longer re-validate
+#                   - chore: _require() checks emptiness inline, get_branch/get_hash_and_branch test the branch once
+#                   - chore: tags are parsed in a single pass over the characters
+#                   - chore: increments are handled as plain strings, VersionIncrement is still a str Enum for callers
+#                   - chore: nuget starts from semver_full instead of rebuilding it
+#                   - fix: commits since the last tag are counted with rev-list --ancestry-path again, the describe
+#                          count differed when merges were involved
+#                   - fix: the version cache sees tags created under a prefix directory (refs/tags/svc/...) and
+#                          ignores entries written with a different set of fields
+#                   - fix: get_version() runs on a copy of the context so the repo snapshot isn't reused by later runs
+#                   - fix: exec() returns a failed result for an empty command again, a missing git fails lookups
+#                          instead of raising
+#                   - fix: exec(capture=True) captures stderr again, callers get a string instead of None. git lookups
+#                          that only need stdout go through _git_out(), which still discards it
+#                   - fix: at most 4 git cat-file sessions are kept, the least recently used one is closed
+#
 # Tue, Jul 30, 2024 - feat: added --no-quotes option specifically for github actions. expressions are run
 #                     prior to bash execution so ${{ .env.BUILD_SEMVER_FULL }} will contain quotes.
 #                   - fix: default for show should be "all" fields like before
@@ -23,27 +67,39 @@
 #
 # Sun, Apr 21, 2024 - initial version
 #
-import argparse
-import json
+import atexit
+import functools
 import os
-import re
-import shlex
+import shutil
 import subprocess
-import sys
-from dataclasses import dataclass
-
-if sys.version_info < (3, 12):
-    from datetime import datetime
-else:
-    from datetime import datetime, UTC
-
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
 from enum import Enum
 from subprocess import CompletedProcess
+from typing import List, Union
+
+
+class _SanitizeTable(dict):
+    """
+    str.translate() table mapping everything except ascii letters and digits to "-".
+    Code points outside of ascii are added the first time they are seen.
+    """
+
+    def __missing__(self, ordinal: int):
+        c = chr(ordinal)
+        self[ordinal] = ordinal if c.isascii() and c.isalnum() else "-"
+        return self[ordinal]
+
 
-semver_rx = re.compile(r"\.")
+branch_sanitize_table = _SanitizeTable(
+    {o: o if chr(o).isalnum() else "-" for o in range(128)}
+)
 
 
 class VersionIncrement(str, Enum):
+    # the pipeline compares plain strings, members are equal to (and hash like) their value
     MAJOR = "MAJOR"
     MINOR = "MINOR"
     PATCH = "PATCH"
@@ -52,15 +108,27 @@ class VersionIncrement(str, Enum):
         return self.value
 
 
-@dataclass
+@dataclass(slots=True)
+class RepoSnapshot:
+    hash: str = None
+    branch: str = None  # None when detached
+    tags: dict = None  # tag name -> commit hash
+    branches: dict = None  # branch name -> commit hash
+    describe: tuple = None  # _git_describe() for hash
+
+
+@dataclass(slots=True)
 class VersionContext:
-    increment: VersionIncrement
+    increment: str  # "MAJOR", "MINOR" or "PATCH", a VersionIncrement works as well
     tag_prefix: str = None
     work_tree: str = None
     strip_branch_components: int = None
+    # git state for a single get_version() run, set by get_repo_snapshot. Not an init
+    # argument so replace() and new contexts start without one
+    snapshot: RepoSnapshot = field(default=None, init=False, repr=False, compare=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class Version:
     major: int = None
     minor: int = None
@@ -81,18 +149,36 @@ class Version:
     timestamp: str = None
 
 
+VERSION_FIELDS = tuple(Version.__dataclass_fields__)
+
+
+@functools.lru_cache(maxsize=32)
+def _which(program: str) -> str:
+    return shutil.which(program) or program
+
+
 def exec(
-    cmd: str,
+    cmd: Union[str, List[str]],
     cwd: str = None,
     capture: bool = False,
     input: str = None,
 ) -> CompletedProcess[str]:
-    args = [arg.strip() for arg in shlex.split(cmd.strip())]
+    if isinstance(cmd, str):
+        # git calls in here pass argv lists, only callers' command lines need parsing
+        import shlex
+
+        args = [arg.strip() for arg in shlex.split(cmd.strip())]
+    else:
+        args = list(cmd)
     try:
+        # subprocess only uses posix_spawn() instead of fork()/exec() when it gets a path
+        # to the executable, close_fds=False and no cwd. git calls use -C instead of cwd
+        args[0] = _which(args[0])
         return subprocess.run(
             args,
             check=False,
             text=True,
+            close_fds=False,
             cwd=cwd,
             capture_output=capture,
             input=input,
@@ -102,20 +188,254 @@ def exec(
 
 
 def _none_or_empty(s: str) -> bool:
-    return not s or len(s.strip()) == 0
+    # isspace() is False for "", which "not s" already covers
+    return not s or s.isspace()
+
+
+def _require(ver: Version, *fields: str):
+    """
+    Raises a ValueError for the first field that is None or an empty string
+    """
+    for name in fields:
+        value = getattr(ver, name)
+        if value is None or (isinstance(value, str) and (not value or value.isspace())):
+            raise ValueError(f"No {name} found.")
+
+
+@functools.lru_cache(maxsize=32)
+def _git_argv(work_tree: str) -> tuple:
+    git = _which("git")
+    return (git, "-C", work_tree) if work_tree else (git,)
+
+
+def _git_cmd_prefix(ctx: VersionContext) -> tuple:
+    # work_tree can be changed after the context is created, so cache on the value
+    return _git_argv(ctx.work_tree)
+
+
+class _GitSession:
+    """
+    Long running `git cat-file --batch-check` process that resolves revisions
+    (HEAD, tags, ...) to object ids without starting a new git for each lookup
+    """
+
+    def __init__(self, work_tree: str = None):
+        args = [
+            *_git_argv(work_tree),
+            "cat-file",
+            "--batch-check=%(objectname) %(objecttype)",
+        ]
+        self.lock = threading.Lock()
+        try:
+            self.proc = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                close_fds=False,
+            )
+        except OSError:
+            # no git, every lookup fails like a missing revision
+            self.proc = None
+
+    def resolve(self, rev: str) -> str:
+        """
+        Returns the object id for rev or None if it doesn't exist
+        """
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                return None
+            try:
+                self.proc.stdin.write(f"{rev}\n")
+                self.proc.stdin.flush()
+                line = self.proc.stdout.readline()
+            except OSError:
+                return None
+
+        # "<rev> missing" or "<rev> ambiguous" when it can't be resolved
+        parts = line.split()
+        if len(parts) != 2 or parts[1] in ("missing", "ambiguous"):
+            return None
+        return parts[0]
+
+    def close(self):
+        with self.lock:
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.stdin.close()
+                self.proc.wait()
+
+
+# most recently used last. callers versioning many repos only keep a few git processes
+# alive, the least recently used session is closed when a new one is needed
+_GIT_SESSIONS_MAX = 4
+_git_sessions = OrderedDict()
+_git_sessions_lock = threading.Lock()
+
+
+def _git_session(ctx: VersionContext) -> _GitSession:
+    evicted = None
+    with _git_sessions_lock:
+        session = _git_sessions.get(ctx.work_tree)
+        if session is not None:
+            _git_sessions.move_to_end(ctx.work_tree)
+            return session
+        session = _git_sessions[ctx.work_tree] = _GitSession(ctx.work_tree)
+        if len(_git_sessions) > _GIT_SESSIONS_MAX:
+            _, evicted = _git_sessions.popitem(last=False)
+    if evicted is not None:
+        evicted.close()
+    return session
+
+
+@atexit.register
+def _close_git_sessions():
+    with _git_sessions_lock:
+        sessions = list(_git_sessions.values())
+        _git_sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+#
+# Cached git lookups. These are keyed on the git command prefix (work tree) and
+# assume the repo doesn't change underneath us. Call clear_version_caches() if
+# it does (ie. tags or commits were added).
+#
+def _git_out(git_prefix: tuple, *args: str) -> str:
+    """
+    Runs git and returns its stripped stdout, or None if it failed. git_prefix is
+    _git_cmd_prefix() so the executable is already resolved (see exec)
+    """
+    try:
+        result = subprocess.run(
+            [*git_prefix, *args],
+            text=True,
+            close_fds=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def _describe_args(rev: str, tag_prefix: str) -> tuple:
+    return ("describe", "--tags", "--long", f"--match={tag_prefix}*", f"{rev}^")
+
+
+def _describe_tag_prefix(ctx: VersionContext) -> str:
+    return ctx.tag_prefix if ctx.tag_prefix else "[0-9]"
+
+
+@functools.lru_cache(maxsize=512)
+def _git_describe(git_prefix: tuple, git_hash: str, tag_prefix: str) -> tuple:
+    """
+    Returns the last tag before git_hash and the number of commits from it to git_hash^,
+    or (None, None) if there isn't one
+    """
+    out = _git_out(git_prefix, *_describe_args(git_hash, tag_prefix))
+    return (None, None) if out is None else _parse_describe(out)
+
+
+def _parse_describe(out: str) -> tuple:
+    """
+    Splits `git describe --long` output (<tag>-<commits>-g<abbreviated hash>) into the
+    tag and commit count. Tags can contain dashes so split from the right
+    """
+    parts = out.rsplit("-", 2)
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].startswith("g"):
+        raise ValueError(f"Unexpected git describe output '{out}'.")
+    return parts[0], int(parts[1])
 
 
-def _git_cmd_prefix(ctx: VersionContext) -> str:
-    work_tree = f"-C {ctx.work_tree}" if ctx.work_tree else ""
-    return f"git {work_tree}"
+@functools.lru_cache(maxsize=512)
+def _git_commit_count(git_prefix: tuple, last_tag: str, rev: str) -> int:
+    out = _git_out(
+        git_prefix, "rev-list", "--ancestry-path", f"{last_tag}..{rev}", "--count"
+    )
+    return None if out is None else int(out)
+
+
+def clear_version_caches():
+    """
+    Clears the cached git lookups
+    """
+    _git_describe.cache_clear()
+    _git_commit_count.cache_clear()
+    _close_git_sessions()
 
 
 def get_github_branch(ctx: VersionContext, ver: Version) -> Version:
     """
     If running in github actions use the GITHUB_HEAD_REF env var
     """
-    if "GITHUB_HEAD_REF" in os.environ:
-        ver.branch = os.environ["GITHUB_HEAD_REF"].strip()
+    # only set for pull requests, other events have it empty
+    branch = os.environ.get("GITHUB_HEAD_REF", "").strip()
+    if branch:
+        ver.branch = branch
+    return ver
+
+
+def get_repo_snapshot(ctx: VersionContext, ver: Version) -> Version:
+    """
+    Collect HEAD's hash and branch plus the commit of every tag with a single git call
+    so the steps that follow don't each have to run git. The last tag (describe) doesn't
+    depend on the refs so it runs at the same time
+    """
+    ctx.snapshot = None
+    try:
+        describe = subprocess.Popen(
+            [*_git_cmd_prefix(ctx), *_describe_args("HEAD", _describe_tag_prefix(ctx))],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            close_fds=False,
+        )
+    except OSError:
+        describe = None
+
+    # not _git_out, stripping would eat the leading %(HEAD) column of the first line
+    result = exec(
+        [
+            *_git_cmd_prefix(ctx),
+            "for-each-ref",
+            "--format=%(HEAD)%09%(objectname)%09%(*objectname)%09%(refname)",
+            "refs/heads",
+            "refs/tags",
+        ],
+        capture=True,
+    )
+    describe_out = describe.communicate()[0].strip() if describe else None
+    if result.returncode != 0:
+        return ver
+
+    snapshot = RepoSnapshot(tags={}, branches={})
+    for line in result.stdout.splitlines():
+        head, objectname, commit, refname = line.split("\t", 3)
+        if refname.startswith("refs/tags/"):
+            # annotated tags point at a tag object, *objectname is the commit
+            snapshot.tags[refname[len("refs/tags/") :]] = commit or objectname
+        else:
+            branch = refname[len("refs/heads/") :]
+            snapshot.branches[branch] = objectname
+            if head == "*":
+                snapshot.hash = objectname
+                snapshot.branch = branch
+
+    if snapshot.hash is None:
+        # detached, there is no current branch to read the hash from
+        snapshot.hash = _git_session(ctx).resolve("HEAD")
+        if snapshot.hash is None:
+            return ver
+
+    if describe is not None:
+        if describe.returncode == 0:
+            snapshot.describe = _parse_describe(describe_out)
+        else:
+            snapshot.describe = (None, None)
+
+    ctx.snapshot = snapshot
     return ver
 
 
@@ -123,13 +443,16 @@ def get_branch(ctx: VersionContext, ver: Version) -> Version:
     """
     Get the branch name if not already set
     """
-    if _none_or_empty(ver.branch):
-        result = exec(
-            f"{_git_cmd_prefix(ctx)} rev-parse --abbrev-ref HEAD", capture=True
-        )
-        if result.returncode != 0:
+    if not _none_or_empty(ver.branch):
+        return ver
+
+    if ctx.snapshot:
+        ver.branch = ctx.snapshot.branch if ctx.snapshot.branch else "HEAD"
+    else:
+        branch = _git_out(_git_cmd_prefix(ctx), "rev-parse", "--abbrev-ref", "HEAD")
+        if branch is None:
             raise ValueError("No git branch found.")
-        ver.branch = result.stdout.strip()
+        ver.branch = branch
 
     return ver
 
@@ -138,19 +461,34 @@ def get_detached_branch(ctx: VersionContext, ver: Version) -> Version:
     """
     Try to determine the branch name if we are detached (branch == HEAD)
     """
-    if _none_or_empty(ver.branch):
-        raise ValueError("No branch found.")
-    if _none_or_empty(ver.hash):
-        raise ValueError("No hash found.")
+    _require(ver, "branch", "hash")
 
     if ver.branch.strip().lower() == "head":
         git_hash = ver.hash
-        raw_branches = exec(
-            f"{_git_cmd_prefix(ctx)} branch --contains {git_hash}", capture=True
-        ).stdout.strip()
-        branches = [
-            line.strip() for line in raw_branches.splitlines() if "HEAD" not in line
-        ]
+        # usually a branch tip is checked out (ie. CI), those are just a ref lookup
+        if ctx.snapshot and ctx.snapshot.branches is not None:
+            branches = [b for b, h in ctx.snapshot.branches.items() if h == git_hash]
+        else:
+            branches = (
+                _git_out(
+                    _git_cmd_prefix(ctx),
+                    "for-each-ref",
+                    f"--points-at={git_hash}",
+                    "--format=%(refname:short)",
+                    "refs/heads/",
+                )
+                or ""
+            ).split()
+        if not branches:
+            # not a tip, fall back to walking history for branches that contain it
+            raw_branches = (
+                _git_out(_git_cmd_prefix(ctx), "branch", "--contains", git_hash) or ""
+            )
+            branches = [
+                line.strip()
+                for line in raw_branches.splitlines()
+                if "HEAD" not in line
+            ]
         if len(branches) > 1:
             raise ValueError(
                 f"Multiple branches found for {git_hash}. Could not determine branch name"
@@ -163,29 +501,27 @@ def sanitize_branch_name(ctx: VersionContext, ver: Version) -> Version:
     """
     Removes special characters from the branch name
     """
-    if _none_or_empty(ver.branch):
-        raise ValueError("No branch found.")
+    _require(ver, "branch")
 
-    ver.branch = re.sub(r"[^a-zA-Z0-9]", "-", ver.branch)
+    ver.branch = ver.branch.translate(branch_sanitize_table)
     return ver
 
 
 def strip_branch_components(ctx: VersionContext, ver: Version) -> Version:
+    # None and 0 both mean keep the whole branch
     if ctx.strip_branch_components:
-        if ctx.strip_branch_components == 0:
-            return ver
-
-        if _none_or_empty(ver.branch):
-            raise ValueError("No branch found.")
-
-        parts = ver.branch.split("/")
-        remaining = len(parts) - ctx.strip_branch_components
-        if remaining < 1:
-            raise ValueError(
-                f"Cannot strip {ctx.strip_branch_components} components from a branch '{ver.branch}' with only {len(parts)} component(s)"
-            )
-
-        ver.branch = "/".join(ver.branch.split("/")[ctx.strip_branch_components :])
+        _require(ver, "branch")
+
+        rest = ver.branch
+        for _ in range(ctx.strip_branch_components):
+            _, sep, rest = rest.partition("/")
+            if not sep:
+                # stripping needs to leave at least one component
+                raise ValueError(
+                    f"Cannot strip {ctx.strip_branch_components} components from a branch '{ver.branch}' with only {ver.branch.count('/') + 1} component(s)"
+                )
+
+        ver.branch = rest
     return ver
 
 
@@ -193,15 +529,17 @@ def get_commit_count(ctx: VersionContext, ver: Version) -> Version:
     #
     # Get the number of commits since the last tag
     #
-    if _none_or_empty(ver.last_tag):
-        raise ValueError("No last_tag found.")
+    _require(ver, "last_tag")
 
-    result = exec(
-        f"{_git_cmd_prefix(ctx)} rev-list --ancestry-path {ver.last_tag}..HEAD --count",
-        capture=True,
-    )
-    if result.returncode == 0:
-        ver.commits = int(result.stdout.strip())
+    if _none_or_empty(ver.hash):
+        # HEAD can move between calls, only cache lookups against a known hash
+        commits = _git_commit_count.__wrapped__(
+            _git_cmd_prefix(ctx), ver.last_tag, "HEAD"
+        )
+    else:
+        commits = _git_commit_count(_git_cmd_prefix(ctx), ver.last_tag, ver.hash)
+    if commits is not None:
+        ver.commits = commits
 
     return ver
 
@@ -210,45 +548,104 @@ def get_hash(ctx: VersionContext, ver: Version) -> Version:
     """
     Get the latest commit hash
     """
-    result = exec(f"{_git_cmd_prefix(ctx)} rev-parse HEAD", capture=True)
-    if result.returncode == 0:
-        ver.hash = result.stdout.strip()
+    if ctx.snapshot:
+        ver.hash = ctx.snapshot.hash
+        return ver
+
+    git_hash = _git_session(ctx).resolve("HEAD")
+    if git_hash is not None:
+        ver.hash = git_hash
+    return ver
+
+
+def get_hash_and_branch(ctx: VersionContext, ver: Version) -> Version:
+    """
+    get_hash and get_branch in one step. Uses the snapshot if there is one, otherwise a
+    single `git rev-parse` call. An existing branch (ie. GITHUB_HEAD_REF) is kept
+    """
+    if ctx.snapshot:
+        ver.hash = ctx.snapshot.hash
+        if _none_or_empty(ver.branch):
+            ver.branch = ctx.snapshot.branch if ctx.snapshot.branch else "HEAD"
+        return ver
+
+    if not _none_or_empty(ver.branch):
+        return get_hash(ctx, ver)
+
+    out = _git_out(_git_cmd_prefix(ctx), "rev-parse", "HEAD", "--abbrev-ref", "HEAD")
+    if out is None:
+        return ver
+
+    ver.hash, ver.branch = out.split()
     return ver
 
 
+def _increment_major(ver: Version):
+    ver.major += 1
+    ver.minor = 0
+    ver.patch = 0
+
+
+def _increment_minor(ver: Version):
+    ver.minor += 1
+    ver.patch = 0
+
+
+def _increment_patch(ver: Version):
+    ver.patch += 1
+
+
+_INCREMENTS = {
+    VersionIncrement.MAJOR: _increment_major,
+    VersionIncrement.MINOR: _increment_minor,
+    VersionIncrement.PATCH: _increment_patch,
+}
+
+
+def _parse_version(s: str) -> tuple:
+    """
+    Parses "1.2.3" into (1, 2, 3), None if it isn't exactly three ascii numbers
+    """
+    # one pass over the characters, no partitions and no int() re-reading the digits.
+    # int() alone would accept "+1", " 1" and "1_0"
+    parts = [0, 0, 0]
+    stage = 0
+    digits = 0
+    for ch in s:
+        if ch == ".":
+            if not digits or stage == 2:
+                return None
+            stage += 1
+            digits = 0
+        else:
+            d = ord(ch) - 48
+            if not 0 <= d <= 9:
+                return None
+            parts[stage] = parts[stage] * 10 + d
+            digits += 1
+    if stage != 2 or not digits:
+        return None
+    return tuple(parts)
+
+
 def build_version_components(ctx: VersionContext, ver: Version) -> Version:
     #
     # Populate the version components from the tag
     #
-    if _none_or_empty(ver.last_tag):
-        raise ValueError("No last_tag found.")
+    _require(ver, "last_tag")
 
     last_ver = ver.last_tag
     if ver.tag_prefix and len(ver.tag_prefix) > 0:
         last_ver = ver.last_tag[len(ver.tag_prefix) :].strip()
 
-    parts = re.split(semver_rx, last_ver)
-    if (
-        len(parts) != 3
-        or not parts[0].isdigit()
-        or not parts[1].isdigit()
-        or not parts[2].isdigit()
-    ):
+    components = _parse_version(last_ver)
+    if components is None:
         raise ValueError("Invalid tag format. Expected 1.2.3")
+    ver.major, ver.minor, ver.patch = components
 
-    ver.major = int(parts[0])
-    ver.minor = int(parts[1])
-    ver.patch = int(parts[2])
-
-    if ctx.increment == VersionIncrement.MAJOR:
-        ver.major += 1
-        ver.minor = 0
-        ver.patch = 0
-    elif ctx.increment == VersionIncrement.MINOR:
-        ver.minor += 1
-        ver.patch = 0
-    elif ctx.increment == VersionIncrement.PATCH:
-        ver.patch += 1
+    increment = _INCREMENTS.get(ctx.increment)
+    if increment:
+        increment(ver)
 
     return ver
 
@@ -269,10 +666,7 @@ def validate_version_components(ver: Version) -> Version:
 def validate_semver(ver: Version) -> Version:
     validate_version_components(ver)
 
-    if _none_or_empty(ver.branch):
-        raise ValueError("No branch found.")
-    if ver.commits is None:
-        raise ValueError("No commits found.")
+    _require(ver, "branch", "commits")
 
     return ver
 
@@ -286,12 +680,14 @@ def build_tag(ctx: VersionContext, ver: Version) -> Version:
     return ver
 
 
+# branches that don't get a prerelease suffix
+_MAIN_BRANCHES = frozenset(("main", "master"))
+
+
 def _get_branch_full(ver: Version, separator: str = "-") -> str:
-    branch_value = (
-        f"{separator}{ver.branch}" if ver.branch not in ("main", "master") else ""
-    )
-    commits_value = f".{ver.commits}" if ver.branch not in ("main", "master") else ""
-    return f"{branch_value}{commits_value}"
+    if ver.branch in _MAIN_BRANCHES:
+        return ""
+    return f"{separator}{ver.branch}.{ver.commits}"
 
 
 def build_semver(ctx: VersionContext, ver: Version) -> Version:
@@ -304,7 +700,8 @@ def build_semver(ctx: VersionContext, ver: Version) -> Version:
 
 
 def build_pep440(ctx: VersionContext, ver: Version) -> Version:
-    validate_semver(ver)
+    # build_semver has already validated the components
+    _require(ver, "semver", "branch", "commits")
 
     ver.pep440 = f"{ver.semver}{_get_branch_full(ver, separator='+')}"
 
@@ -312,9 +709,10 @@ def build_pep440(ctx: VersionContext, ver: Version) -> Version:
 
 
 def build_nuget(ctx: VersionContext, ver: Version) -> Version:
-    validate_semver(ver)
+    # same string as semver_full, so build_semver has to run first
+    _require(ver, "semver_full")
 
-    ver.nuget = f"{ver.semver}{_get_branch_full(ver)}"
+    ver.nuget = ver.semver_full
     # nuget has a max length of 20 chars for prerelease versions
     # https://github.com/NuGet/Home/issues/1459
     if len(ver.nuget) > 20:
@@ -327,8 +725,7 @@ def apply_tag_prefix(ctx: VersionContext, ver: Version) -> Version:
     #
     # Adds prefix to version output (if it exists)
     #
-    if _none_or_empty(ver.last_tag):
-        raise ValueError("No last_tag found.")
+    _require(ver, "last_tag")
 
     if ctx.tag_prefix and ver.last_tag.startswith(ctx.tag_prefix):
         ver.tag_prefix = ctx.tag_prefix
@@ -340,36 +737,42 @@ def get_last_tag(ctx: VersionContext, ver: Version) -> Version:
     #
     # Get the last tag version (1.2.3) prior to this commit
     #
-    if _none_or_empty(ver.hash):
-        raise ValueError("No hash found.")
-
-    tag_prefix = ctx.tag_prefix if ctx.tag_prefix else "[0-9]"
+    _require(ver, "hash")
 
     # get last tag
-    result = exec(
-        f"{_git_cmd_prefix(ctx)} describe --tags --abbrev=0 --match={tag_prefix}* {ver.hash}^",
-        capture=True,
-    )
-    if result.returncode == 0:
-        ver.last_tag = result.stdout.strip()
+    if ctx.snapshot and ctx.snapshot.describe and ctx.snapshot.hash == ver.hash:
+        last_tag, commits = ctx.snapshot.describe
+    else:
+        last_tag, commits = _git_describe(
+            _git_cmd_prefix(ctx), ver.hash, _describe_tag_prefix(ctx)
+        )
+    if last_tag is None:
+        return ver
+    ver.last_tag = last_tag
+
+    # describe counts every commit in last_tag..hash^, which includes merged commits that
+    # don't descend from the tag. Only trust it when the tag is the parent itself
+    if commits == 0:
+        ver.commits = 1
+    else:
+        commits = _git_commit_count(_git_cmd_prefix(ctx), ver.last_tag, ver.hash)
+        if commits is not None:
+            ver.commits = commits
 
     # get last tag hash
-    result = exec(
-        f"{_git_cmd_prefix(ctx)} rev-list -n 1 {ver.last_tag}",
-        capture=True,
-    )
-    if result.returncode == 0:
-        ver.last_hash = result.stdout.strip()
+    if ctx.snapshot and ver.last_tag in ctx.snapshot.tags:
+        last_hash = ctx.snapshot.tags[ver.last_tag]
+    else:
+        # peel annotated tags to the commit they point at
+        last_hash = _git_session(ctx).resolve(f"{ver.last_tag}^{{commit}}")
+    if last_hash is not None:
+        ver.last_hash = last_hash
 
     return ver
 
 
 def get_timestamp(ctx: VersionContext, ver: Version) -> Version:
-    if sys.version_info < (3, 12):
-        now = datetime.utcnow()
-    else:
-        now = datetime.now(UTC)
-    ver.timestamp = now.strftime("%Y%m%dT%H%M%SZ")
+    ver.timestamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
     return ver
 
 
@@ -377,54 +780,165 @@ def validate_context(ctx: VersionContext, ver: Version) -> Version:
     #
     # Validate the increment type
     #
-    if ctx.increment not in [
-        VersionIncrement.MAJOR,
-        VersionIncrement.MINOR,
-        VersionIncrement.PATCH,
-    ]:
+    if ctx.increment not in _INCREMENTS:
         raise ValueError("Invalid increment value. Must be major, minor, or patch")
 
     return ver
 
 
+DEFAULT_PIPELINE = (
+    validate_context,
+    get_timestamp,
+    # before git so a known branch skips looking it up
+    get_github_branch,
+    get_repo_snapshot,
+    get_hash_and_branch,
+    get_last_tag,
+    apply_tag_prefix,
+    get_detached_branch,
+    strip_branch_components,
+    sanitize_branch_name,
+    build_version_components,
+    build_tag,
+    build_semver,
+    build_pep440,
+    build_nuget,
+)
+
+# output fields -> the format builders that produce them
+FIELD_BUILDERS = {
+    "tag": [build_tag],
+    "semver": [build_semver],
+    "semver_full": [build_semver],
+    "pep440": [build_semver, build_pep440],
+    "nuget": [build_semver, build_nuget],
+}
+
+
+def get_pipeline(show: str = "all") -> tuple:
+    """
+    The default pipeline without the format builders that aren't needed for the
+    comma separated fields in show
+    """
+    if not show or show == "all":
+        return DEFAULT_PIPELINE
+
+    builders = {f for funcs in FIELD_BUILDERS.values() for f in funcs}
+    needed = {f for key in show.split(",") for f in FIELD_BUILDERS.get(key, [])}
+    return tuple(f for f in DEFAULT_PIPELINE if f not in builders or f in needed)
+
+
 def get_version(
     ctx: VersionContext,
-    funcs=[
-        validate_context,
-        get_timestamp,
-        get_hash,
-        get_last_tag,
-        get_commit_count,
-        apply_tag_prefix,
-        get_github_branch,
-        get_branch,
-        get_detached_branch,
-        strip_branch_components,
-        sanitize_branch_name,
-        build_version_components,
-        build_tag,
-        build_semver,
-        build_pep440,
-        build_nuget,
-    ],
+    funcs=DEFAULT_PIPELINE,
 ) -> Version:
-    i = 1
+    # each run gets its own copy of the context, the snapshot it collects can't go
+    # stale in a context the caller reuses
+    ctx = replace(ctx)
     v = Version()
     for f in funcs:
-        # print(i, f.__name__, v)
         v = f(ctx, v)
-        i += 1
     return v
 
 
+def _cache_validator(ctx: VersionContext) -> list:
+    """
+    Values that change when HEAD moves, a commit is added or tags/refs change. None if
+    there is no .git directory in the work tree (ie. run from a subdirectory)
+    """
+    git_dir = os.path.join(ctx.work_tree or os.getcwd(), ".git")
+    head_file = os.path.join(git_dir, "HEAD")
+    try:
+        with open(head_file) as f:
+            head = f.read().strip()
+        validator = [head, os.stat(head_file).st_mtime_ns]
+    except OSError:
+        return None
+
+    paths = [os.path.join(git_dir, "packed-refs")]
+    if head.startswith("ref: "):
+        # commits update the branch ref, not HEAD
+        paths.append(os.path.join(git_dir, head[len("ref: ") :]))
+    for path in paths:
+        try:
+            validator.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            validator.append(0)
+
+    # a new tag only touches the directory it's created in, ie. refs/tags/svc for svc/v1.0.0
+    for tags_dir, _, _ in os.walk(os.path.join(git_dir, "refs", "tags")):
+        try:
+            validator.append(os.stat(tags_dir).st_mtime_ns)
+        except OSError:
+            validator.append(0)
+
+    validator.append(os.environ.get("GITHUB_HEAD_REF"))
+    return validator
+
+
+def get_cached_version(ctx: VersionContext) -> Version:
+    """
+    get_version() backed by a json file in $XDG_CACHE_HOME/python-version. The cached
+    version is reused (with a new timestamp) until the validator above changes
+    """
+    import hashlib
+    import json
+
+    validator = _cache_validator(ctx)
+    if validator is None:
+        return get_version(ctx)
+
+    work_tree = os.path.realpath(ctx.work_tree or os.getcwd())
+    repo_id = hashlib.sha256(work_tree.encode()).hexdigest()[:16]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    cache_file = os.path.join(cache_home, "python-version", f"{repo_id}.json")
+    key = f"{ctx.increment}|{ctx.tag_prefix}|{ctx.strip_branch_components}"
+
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if not isinstance(cache, dict):
+        cache = {}
+
+    entry = cache.get(key)
+    # entries written by a version with different fields are a miss
+    if (
+        isinstance(entry, dict)
+        and entry.get("validator") == validator
+        and isinstance(entry.get("version"), dict)
+        and entry["version"].keys() == set(VERSION_FIELDS)
+    ):
+        return get_timestamp(ctx, Version(**entry["version"]))
+
+    ver = get_version(ctx)
+    cache[key] = {
+        "validator": validator,
+        "version": {key: getattr(ver, key) for key in VERSION_FIELDS},
+    }
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}"
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return ver
+
+
 class VersionBuilder:
     def __init__(self):
-        self.increment = VersionIncrement.MINOR
+        self.increment = VersionIncrement.MINOR.value
         self.tag_prefix = None
         self.strip_components = None
+        self.cache = os.environ.get("PYVERSION_CACHE") == "1"
 
-    def withIncrement(self, increment: VersionIncrement):
-        self.increment = increment
+    def withIncrement(self, increment: Union[str, VersionIncrement]):
+        self.increment = str(increment)
         return self
 
     def withTagPrefix(self, tag_prefix: str):
@@ -435,13 +949,17 @@ class VersionBuilder:
         self.strip_components = strip_components
         return self
 
+    def withCache(self):
+        self.cache = True
+        return self
+
     def build(self) -> Version:
         ctx = VersionContext(increment=self.increment)
         if self.tag_prefix:
             ctx.tag_prefix = self.tag_prefix
         if self.strip_components:
             ctx.strip_branch_components = self.strip_components
-        return get_version(ctx)
+        return get_cached_version(ctx) if self.cache else get_version(ctx)
 
 
 class VersionViewBuilder:
@@ -491,53 +1009,50 @@ class VersionViewBuilder:
         return value
 
     def build(self) -> str:
-        ver_dict = vars(self.ver)
+        # slotted dataclass, no __dict__ for vars()
+        ver_dict = {key: getattr(self.ver, key) for key in VERSION_FIELDS}
 
         # get/validate list of keys to print
-        print_keys = []
-        if self.show:
-            if self.show == "all":
-                print_keys = list(ver_dict.keys())
-            else:
-                for key in self.show.split(","):
-                    if key not in ver_dict:
-                        raise ValueError(f"Field '{key}' not found.")
-                print_keys = self.show.split(",")
+        if self.show == "all":
+            print_keys = VERSION_FIELDS
+        elif self.show:
+            print_keys = self.show.split(",")
+            for key in print_keys:
+                if key not in ver_dict:
+                    raise ValueError(f"Field '{key}' not found.")
         else:
-            print_keys.append("semver_full")
+            print_keys = ["semver_full"]
 
         # print output in json
         if self.format == "json":
+            import json
+
             values = {key: ver_dict[key] for key in print_keys}
             return json.dumps(values, indent=4 if self.json_pretty else None)
 
+        values = [
+            str(self._build_value(ver_dict[key], self.no_quotes)) for key in print_keys
+        ]
+
         # print output in env format
-        elif self.format == "env":
-            out = []
-            for key in print_keys:
-                value = ver_dict[key]
-                print_value = str(self._build_value(value, self.no_quotes))
-                out.append(f"{self.env_prefix.upper()}{key.upper()}={print_value}")
-            return "\n".join(out)
+        if self.format == "env":
+            prefix = self.env_prefix.upper()
+            return "\n".join(
+                f"{prefix}{key.upper()}={value}"
+                for key, value in zip(print_keys, values)
+            )
 
         # print output in csv separated format
-        else:
-            out = []
-            if self.csv_header:
-                out.append(",".join(print_keys))
-
-            values = []
-            for key in print_keys:
-                value = str(self._build_value(ver_dict[key], self.no_quotes))
-                values.append(value)
-
-            out.append(",".join(values))
-            return "\n".join(out)
+        row = ",".join(values)
+        return f"{','.join(print_keys)}\n{row}" if self.csv_header else row
 
 
 if __name__ == "__main__":
+    # only the cli needs argparse, keep it off the import path for library use
+    import argparse
+
     doc_keys = ",".join(
-        [k for k in vars(Version()).keys() if k != "last_tag" and k != "last_hash"]
+        [k for k in VERSION_FIELDS if k != "last_tag" and k != "last_hash"]
     )
     parser = argparse.ArgumentParser(
         description="Increment a semantic version component of a git tag."
@@ -580,14 +1095,23 @@ if __name__ == "__main__":
         "--strip-branch-components",
         help="Optional number of branch components (paths) to strip from the start of the branch name",
     )
+    parser.add_argument(
+        "--cache",
+        help="Reuse the last result until HEAD, the branch or tags change. Same as PYVERSION_CACHE=1",
+        action="store_true",
+    )
     args = parser.parse_args()
 
-    ctx = VersionContext(increment=VersionIncrement(args.component.upper()))
+    ctx = VersionContext(increment=args.component.upper())
     if args.tag_prefix:
         ctx.tag_prefix = args.tag_prefix
     if args.strip_branch_components:
         ctx.strip_branch_components = int(args.strip_branch_components)
-    ver = get_version(ctx)
+    if args.cache or os.environ.get("PYVERSION_CACHE") == "1":
+        ver = get_cached_version(ctx)
+    else:
+        # only build the formats that are going to be shown
+        ver = get_version(ctx, funcs=get_pipeline(args.show))
 
     b = VersionViewBuilder(ver)
     b.withShow(args.show)